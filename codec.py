@@ -0,0 +1,148 @@
+'''
+Created on Oct 18, 2026
+
+@author: daniel
+
+Table driven payload codec for the LR210 relay controller and the OY1110
+RHT sensor. Every known uplink and downlink is described by a precompiled
+struct layout in a registry keyed on (device, port, command, index), so
+decoding and encoding is a single dict lookup followed by unpack_from or
+pack_into.
+'''
+
+import struct
+import logging
+from collections import namedtuple
+
+LOGGER = logging.getLogger(__name__)
+
+# Device types
+LR210 = "lr210"
+OY1110 = "oy1110"
+
+# Ports, protocol commands/responses on port 1, periodic data on port 2
+PROTOCOL_PORT = 1
+PERIODIC_PORT = 2
+
+# Protocol commands, a set command is answered with a data response
+CMD_SET = 0x01
+CMD_DATA = 0x01
+CMD_QUERY = 0x02
+
+# Protocol indexes
+IDX_RELAY_STATE = 0x22
+
+# Command and index header of all protocol messages
+HEADER = struct.Struct(">BB")
+
+Codec = namedtuple("Codec", ["name", "layout", "decode"])
+
+
+def _lr210_periodic(values):
+    ''' Relay states and internal temperature (0.1 degrees, 80 offset) '''
+    return {"relay": values[0], "temperature": (values[1] / 10.0) - 80.0}
+
+
+def _lr210_relay_state(values):
+    ''' Relay states following the command and index header '''
+    return {"relay": values[2]}
+
+
+def _oy1110_periodic(values):
+    ''' Ungrouped measurement, 12-bit temperature and humidity packed in 3 bytes '''
+    temp = values[0] << 4 | values[2] >> 4
+    humi = values[1] << 4 | values[2] & 0xF
+    return {"temperature": (temp - 800) / 10.0,
+            "humidity": (humi - 250) / 10.0}
+
+
+def _protocol_response(values):
+    ''' Generic protocol response, header only '''
+    return {"command": values[0], "index": values[1]}
+
+
+# Uplink registry, periodic data has no command/index and uses None as key
+_UPLINK = {
+    (LR210, PERIODIC_PORT, None, None):
+        Codec("periodic", struct.Struct(">HH"), _lr210_periodic),
+    (LR210, PROTOCOL_PORT, CMD_DATA, IDX_RELAY_STATE):
+        Codec("relay_state", struct.Struct(">BBH"), _lr210_relay_state),
+    (OY1110, PERIODIC_PORT, None, None):
+        Codec("periodic", struct.Struct(">BBB"), _oy1110_periodic),
+}
+
+# Devices using the command/index framing on the protocol port
+_PROTOCOL_DEVICES = (LR210, OY1110)
+
+_GENERIC_RESPONSE = Codec("response", HEADER, _protocol_response)
+
+# Downlink registry, layouts include the command and index header
+_DOWNLINK = {
+    (LR210, PROTOCOL_PORT, CMD_SET, IDX_RELAY_STATE): struct.Struct(">BBI"),
+    (LR210, PROTOCOL_PORT, CMD_QUERY, IDX_RELAY_STATE): HEADER,
+}
+
+
+def decode(device, port, data):
+    '''
+    Decode uplink data (bytearray) from device received on port. Returns a
+    tuple of message name and a dict of decoded values, or None if the
+    data could not be decoded
+    '''
+    codec = _UPLINK.get((device, port, None, None))
+    if codec is None:
+        if port != PROTOCOL_PORT or device not in _PROTOCOL_DEVICES:
+            LOGGER.error("Unknown port in %s UL data: %s", device, str(port))
+            return None
+        if len(data) < HEADER.size:
+            LOGGER.error("Short %s protocol data!", device)
+            return None
+        command, index = HEADER.unpack_from(data)
+        codec = _UPLINK.get((device, port, command, index), _GENERIC_RESPONSE)
+
+    if codec is _GENERIC_RESPONSE:
+        # Unknown index, pass the raw value along
+        values = codec.decode(HEADER.unpack_from(data))
+        values["data"] = bytes(data[HEADER.size:])
+        return (codec.name, values)
+
+    # Periodic data must match exactly, protocol data may carry trailing bytes
+    if len(data) < codec.layout.size or \
+    (port == PERIODIC_PORT and len(data) != codec.layout.size):
+        LOGGER.error("Unexpected %s %s data length %d!", device, codec.name,
+                     len(data))
+        return None
+
+    return (codec.name, codec.decode(codec.layout.unpack_from(data)))
+
+
+def _downlink_layout(device, port, command, index):
+    try:
+        return _DOWNLINK[(device, port, command, index)]
+    except KeyError:
+        raise RuntimeError("Unknown downlink command!")
+
+
+def new_buffer(device, port, command, index):
+    '''
+    Returns a zeroed bytearray sized for the given downlink, intended to be
+    kept and reused with pack_into
+    '''
+    return bytearray(_downlink_layout(device, port, command, index).size)
+
+
+def pack_into(buf, device, port, command, index, *values):
+    '''
+    Pack a downlink including its command and index header into buf
+    '''
+    _downlink_layout(device, port, command, index).pack_into(buf, 0, command,
+                                                             index, *values)
+    return buf
+
+
+def encode(device, port, command, index, *values):
+    '''
+    Returns a new bytearray containing the encoded downlink
+    '''
+    buf = new_buffer(device, port, command, index)
+    return pack_into(buf, device, port, command, index, *values)
@@ -0,0 +1,226 @@
+'''
+Created on Oct 18, 2026
+
+@author: daniel
+
+Declarative deployment configuration, a JSON file describing the MQTT
+broker, LoRa Server API, retry policy and the controlled zones. Example:
+
+{
+    "mqtt": {"host": "lorans.home.dnil.se", "port": 1883},
+    "retry": {"period_minutes": 5, "max_retries": 5},
+    "zones": {
+        "garage": {
+            "rht_sensor": {"application": "application/6",
+                           "dev_eui": "70b3d5d7201c0029"},
+            "lr210": {"application": "application/20",
+                      "dev_eui": "70b3d5d72ffc8000", "channel": 1},
+            "thermostat": {"min_temp": -15.0, "max_rh": 80.0}
+        }
+    }
+}
+
+A zone may also hold a "multicast_group" with "application", "group_id"
+and "dev_euis", driven with the same relay channel as the zone LR210.
+Thermostat "mode" is one of thermostat.THERMOSTAT_MODES, "dwell" uses the
+dwell_* keys. See DEFAULT_THERMOSTAT for all thermostat keys.
+'''
+
+import os
+import copy
+import json
+import thermostat
+
+DEFAULT_CONFIG = {
+    "mqtt": {"host": "localhost", "port": 1883, "username": "",
+             "password": "", "tls": False},
+    "lora_api": {"url": "", "token": ""},
+    # Device and thermostat state kept over restarts, disabled when empty.
+    # A relative path is relative to the config file
+    "state_file": "",
+    # Status API, disabled with port 0
+    "status": {"host": "127.0.0.1", "port": 0},
+    "retry": {"period_minutes": 5.0, "max_retries": 5,
+              "multicast_verify_minutes": 70.0},
+    "zones": {},
+}
+
+DEFAULT_THERMOSTAT = {"mode": list(thermostat.THERMOSTAT_MODES)[0],
+                      "min_temp": -5.0, "max_rh": 80.0,
+                      "temp_hysteresis": 3.0, "rh_hysteresis": 5.0,
+                      "dwell_min_on_minutes": 20.0,
+                      "dwell_min_off_minutes": 20.0,
+                      "dwell_max_toggles_per_hour": 2,
+                      "dwell_trend_minutes": 180.0,
+                      "dwell_lookahead_minutes": 60.0}
+
+
+try:
+    STRING_TYPES = (str, unicode)
+except NameError:
+    STRING_TYPES = (str,)
+
+# Numeric keys that must be positive or at least zero. With no toggles
+# allowed a dwell thermostat switched on would never switch off
+_POSITIVE = ("period_minutes", "multicast_verify_minutes", "dwell_trend_minutes",
+             "dwell_max_toggles_per_hour")
+_NON_NEGATIVE = ("port", "max_retries", "temp_hysteresis", "rh_hysteresis",
+                 "dwell_min_on_minutes", "dwell_min_off_minutes",
+                 "dwell_lookahead_minutes")
+
+
+def _fail(where, what):
+    raise RuntimeError("Config " + where + ": " + what)
+
+
+def _type_ok(value, default):
+    if isinstance(default, bool):
+        return isinstance(value, bool)
+    if isinstance(default, int):
+        return isinstance(value, int) and not isinstance(value, bool)
+    if isinstance(default, float):
+        return isinstance(value, (int, float)) and not isinstance(value, bool)
+    return isinstance(value, STRING_TYPES)
+
+
+def _merged(where, defaults, values):
+    '''
+    Returns defaults updated with values, checking that values is a dict
+    of known keys with the same types as the defaults
+    '''
+    if values is None:
+        values = {}
+    if not isinstance(values, dict):
+        _fail(where, "must be an object")
+    merged = copy.deepcopy(defaults)
+    for key, value in values.items():
+        if key not in defaults:
+            _fail(where, "unknown key " + key)
+        if not _type_ok(value, defaults[key]):
+            _fail(where, key + " has wrong type")
+        if key in _POSITIVE and value <= 0:
+            _fail(where, key + " must be positive")
+        if key in _NON_NEGATIVE and value < 0:
+            _fail(where, key + " must not be negative")
+        merged[key] = value
+    return merged
+
+
+def _check_device(where, device, fields):
+    ''' Check a device object has exactly fields, all strings '''
+    if not isinstance(device, dict) or set(device) != set(fields):
+        _fail(where, "needs exactly " + ", ".join(fields))
+    for field in fields:
+        if not isinstance(device[field], STRING_TYPES):
+            _fail(where, field + " must be a string")
+
+
+def _validate_zone(zone_name, zone):
+    where = "zone " + zone_name
+    if not isinstance(zone, dict):
+        _fail(where, "must be an object")
+    for key in zone:
+        if key not in ("rht_sensor", "lr210", "multicast_group", "thermostat"):
+            _fail(where, "unknown key " + key)
+
+    _check_device(where + " rht_sensor", zone.get("rht_sensor"),
+                  ("application", "dev_eui"))
+
+    lr210 = zone.get("lr210")
+    if not isinstance(lr210, dict) or "channel" not in lr210:
+        _fail(where + " lr210", "needs exactly application, dev_eui, channel")
+    if lr210["channel"] not in (1, 2) or isinstance(lr210["channel"], bool):
+        _fail(where + " lr210", "invalid relay channel")
+    _check_device(where + " lr210",
+                  dict((key, value) for key, value in lr210.items()
+                       if key != "channel"), ("application", "dev_eui"))
+
+    result = {"rht_sensor": copy.deepcopy(zone["rht_sensor"]),
+              "lr210": copy.deepcopy(lr210)}
+
+    if "multicast_group" in zone:
+        mc_cfg = zone["multicast_group"]
+        if not isinstance(mc_cfg, dict) or \
+        not isinstance(mc_cfg.get("dev_euis"), list) or \
+        not all(isinstance(dev_eui, STRING_TYPES) for dev_eui in mc_cfg["dev_euis"]):
+            _fail(where + " multicast_group", "dev_euis must be a list of strings")
+        _check_device(where + " multicast_group",
+                      dict((key, value) for key, value in mc_cfg.items()
+                           if key != "dev_euis"), ("application", "group_id"))
+        result["multicast_group"] = copy.deepcopy(mc_cfg)
+
+    result["thermostat"] = _merged(where + " thermostat", DEFAULT_THERMOSTAT,
+                                   zone.get("thermostat"))
+    if result["thermostat"]["mode"] not in thermostat.THERMOSTAT_MODES:
+        _fail(where + " thermostat", "invalid mode")
+    return result
+
+
+def validate(cfg):
+    '''
+    Validate a configuration dict and fill in defaults, returns a new dict.
+    Raises RuntimeError on any invalid or unknown key
+    '''
+    if not isinstance(cfg, dict):
+        _fail("file", "must be an object")
+    for key in cfg:
+        if key not in DEFAULT_CONFIG:
+            _fail("file", "unknown key " + key)
+
+    result = {}
+    for section in ("mqtt", "lora_api", "status", "retry"):
+        result[section] = _merged(section, DEFAULT_CONFIG[section],
+                                  cfg.get(section))
+    if result["status"]["port"] > 65535 or result["mqtt"]["port"] > 65535:
+        _fail("file", "invalid port")
+
+    result["state_file"] = cfg.get("state_file", DEFAULT_CONFIG["state_file"])
+    if not isinstance(result["state_file"], STRING_TYPES):
+        _fail("state_file", "must be a string")
+
+    zones = cfg.get("zones", {})
+    if not isinstance(zones, dict):
+        _fail("zones", "must be an object")
+    result["zones"] = dict((zone_name, _validate_zone(zone_name, zone))
+                           for zone_name, zone in zones.items())
+
+    if not result["zones"]:
+        raise RuntimeError("Config has no zones")
+
+    # Raises on devices configured as different types
+    device_types(result)
+
+    return result
+
+
+def load(path):
+    ''' Load and validate a configuration file '''
+    with open(path) as cfg_file:
+        cfg = validate(json.load(cfg_file))
+    if cfg["state_file"]:
+        cfg["state_file"] = os.path.join(os.path.dirname(os.path.abspath(path)),
+                                         cfg["state_file"])
+    return cfg
+
+
+def device_types(cfg):
+    '''
+    Returns a dict of (application, dev_eui) to device class name for all
+    devices of a validated configuration
+    '''
+    types = {}
+
+    def add(application, dev_eui, type_name):
+        if types.setdefault((application, dev_eui), type_name) != type_name:
+            raise RuntimeError("Config device " + dev_eui +
+                               " used as more than one device type")
+
+    for zone in cfg["zones"].values():
+        add(zone["rht_sensor"]["application"], zone["rht_sensor"]["dev_eui"],
+            "RHTSensor")
+        add(zone["lr210"]["application"], zone["lr210"]["dev_eui"], "LR210")
+        mc_cfg = zone.get("multicast_group")
+        if mc_cfg:
+            for dev_eui in mc_cfg["dev_euis"]:
+                add(mc_cfg["application"], dev_eui, "LR210")
+    return types
@@ -4,80 +4,88 @@ Created on Feb 21, 2020
 @author: daniel
 '''
 
+import os
+import copy
+import json
+import time
+import signal
 import logging
-import loraserver
+import functools
+from datetime import timedelta
+import config
+import thermostat
 import oy1110
 import lr210
 
-logging.basicConfig(level=logging.INFO)
 LOGGER = logging.getLogger(__name__)
 
-class RHTThermostat(object):
+class StartupTimer(object):
     '''
-    Implements a thermostat based on both RH and temp data
+    Measures the startup time of the application by phase
     '''
 
-    def __init__(self, min_temp=-5.0, max_rh=80.0):
+    def __init__(self, start_time=None):
         '''
-        Constructor
+        Constructor, start_time (time.time() value) defaults to now
         '''
-        self._min_temp = min_temp
-        self._temp_hyst = 3.0
-        self._max_rh = max_rh
-        self._rh_hyst = 5.0
-        self._actuals_valid = False
-        self._output_state = False
+        self._start = start_time or time.time()
+        self._last = self._start
+        self._phases = []
 
-    def set_rh_hysteresis(self, rh_hyst):
-        '''
-        Override default RH hysteresis, value in percent
-        '''
-        self._rh_hyst = rh_hyst
+    def mark(self, phase):
+        ''' Mark the end of a startup phase '''
+        now = time.time()
+        self._phases.append((phase, now - self._last))
+        self._last = now
 
-    def set_temp_hysteresis(self, temp_hyst):
-        '''
-        Override default temperature hysteresis, value in percent
-        '''
-        self._temp_hyst = temp_hyst
+    def report(self):
+        ''' Log the startup time report '''
+        LOGGER.info("Ready to control in %.0f ms (%s)",
+                    (self._last - self._start) * 1000,
+                    ", ".join("%s %.0f ms" % (phase, duration * 1000)
+                              for phase, duration in self._phases))
 
-    def update_actual_values(self, humidity, temperature):
-        '''
-        Update actual values and performs output calculation
-        '''
-        self._actuals_valid = all([humidity, temperature])
 
-        temp_ok = True
-        hum_ok = True
+class Zone(object):
+    '''
+    One controlled zone, a RHT sensor and thermostat driving a relay channel
+    on a LR210 and optionally on a LR210 multicast group
+    '''
 
-        if self._actuals_valid and self._output_state:
-            # We are heating, check criteria
-            temp_ok = temperature > self._min_temp + (self._temp_hyst / 2)
-            hum_ok = humidity < self._max_rh - (self._rh_hyst / 2)
+    def __init__(self, rht_sensor, lr210_ctrl, relay_channel, thermostat,
+                 lr210_group=None):
+        '''
+        Constructor
+        '''
+        self._rht_sensor = rht_sensor
+        self._lr210_ctrl = lr210_ctrl
+        self._relay_ch = relay_channel
+        self._thermo = thermostat
+        self._lr210_group = lr210_group
 
-        elif self._actuals_valid and not self._output_state:
-            # We are not heating
-            temp_ok = temperature > self._min_temp - (self._temp_hyst / 2)
-            hum_ok = humidity < self._max_rh + (self._rh_hyst / 2)
+    def thermostat(self):
+        ''' Returns the thermostat of this zone '''
+        return self._thermo
 
-        new_output_state = (not temp_ok) or (not hum_ok)
+    def lr210_group(self):
+        ''' Returns the LR210 multicast group of this zone, or None '''
+        return self._lr210_group
 
-        if new_output_state != self._output_state:
-            print("Heather change from " + str(self._output_state) +
-                  " to " + str(new_output_state) +
-                  " temperature OK: " + str(temp_ok) +
-                  " humidity OK: " + str(hum_ok))
-            self._output_state = new_output_state
+    def configure_thermostat(self, thermo_cfg):
+        ''' Apply thermostat config dict, see thermostat.configure_thermostat() '''
+        self._thermo = thermostat.configure_thermostat(self._thermo, thermo_cfg)
 
-    def output_active(self):
-        '''
-        Returns True is the thermostat output shall be send to the relay
-        controller, ie when we have enough data to control the relay
-        '''
-        return self._actuals_valid
+    def control(self):
+        ''' Feed the thermostat and send its output to the relay controllers '''
+        self._thermo.update_actual_values(self._rht_sensor.humidity(),
+                                          self._rht_sensor.temperature(),
+                                          self._rht_sensor.timestamp())
 
-    def output(self):
-        ''' Retrieve output, reflects desired output state (True/False) '''
-        return self._output_state
+        if self._thermo.output_active():
+            new_states = [(self._relay_ch, self._thermo.output())]
+            self._lr210_ctrl.set_channel_state(new_states)
+            if self._lr210_group:
+                self._lr210_group.set_channel_state(new_states)
 
 
 class ClimateController(object):
@@ -86,19 +94,30 @@ class ClimateController(object):
     and loraserver
     '''
 
+    # Zone config keys describing devices, a change needs the zone rebuilt
+    _ZONE_DEVICE_KEYS = ("rht_sensor", "lr210", "multicast_group")
+
+    # Device classes by config.device_types() type name
+    _DEVICE_CLASSES = {"RHTSensor": oy1110.RHTSensor, "LR210": lr210.LR210}
+
     def __init__(self):
         '''
         Constructor
         '''
-        self._mqtt_host = "localhost"
-        self._mqtt_port = 1883
-        self._mqtt_user = ""
-        self._mqtt_pass = ""
-        self._rht_lora_app_loc = None
-        self._lr210_app_app_loc = None
-        self._lr210_relay_ch = None
-        self._mqtt_tls = False
-        self._lr210_ctrl = None
+        self._config = copy.deepcopy(config.DEFAULT_CONFIG)
+        self._config_path = None
+        self._applied = None
+        self._reload_pending = False
+        self._connected = False
+        self._lora_if = None
+        # (application, dev_eui) -> RHTSensor or LR210 object
+        self._devices = {}
+        self._zones = {}
+        self._status_server = None
+        self._saved_state = None
+
+    def _default_zone(self):
+        return self._config["zones"].setdefault("default", {})
 
     def mqtt_server_params(self, mqtt_host="", mqtt_port=None,
                            mqtt_username="", mqtt_password="",
@@ -106,87 +125,382 @@ class ClimateController(object):
         '''
         Setup parameters for connecting to MQTT broker
         '''
+        mqtt_cfg = self._config["mqtt"]
         if mqtt_host:
-            self._mqtt_host = mqtt_host
+            mqtt_cfg["host"] = mqtt_host
         if mqtt_port is not None:
-            self._mqtt_port = mqtt_port
+            mqtt_cfg["port"] = mqtt_port
         if mqtt_username:
-            self._mqtt_user = mqtt_username
+            mqtt_cfg["username"] = mqtt_username
         if mqtt_password:
-            self._mqtt_pass = mqtt_password
+            mqtt_cfg["password"] = mqtt_password
         if mqtt_tls_mode:
-            self._mqtt_tls = True
+            mqtt_cfg["tls"] = True
 
     def rht_sensor_data(self, application, dev_eui):
         '''
         Setup loraserver parameters where to find RHT sensor data
         '''
-        self._rht_lora_app_loc = (application, dev_eui)
+        self._default_zone()["rht_sensor"] = {"application": application,
+                                              "dev_eui": dev_eui}
 
     def lr210_relay_ctrl(self, application, dev_eui, relay_channel):
         '''
         Setup loraserver parameters where to steer LR210 Relay
         '''
-        self._lr210_app_app_loc = (application, dev_eui)
-        self._lr210_relay_ch = relay_channel
+        self._default_zone()["lr210"] = {"application": application,
+                                         "dev_eui": dev_eui,
+                                         "channel": relay_channel}
 
-    def mqtt_connect_handler(self):
+    def lora_api_params(self, api_url, api_token):
         '''
-        Installed as callback when we have connected to LoRa Server MQTT OK
+        Setup LoRa Server REST API parameters, needed for multicast groups
         '''
-        # Perform a one-time query of the current relay states
-        if self._lr210_ctrl:
-            self._lr210_ctrl.request_relay_states()
+        self._config["lora_api"] = {"url": api_url, "token": api_token}
 
-    def run(self):
+    def lr210_multicast_group(self, application, group_id, dev_euis):
         '''
-        Run the main controller, will not return until severe errors occurs
+        Setup a LoRa Server multicast group of LR210 relay controllers
+        following the same relay channel as the main LR210
         '''
+        self._default_zone()["multicast_group"] = {"application": application,
+                                                   "group_id": group_id,
+                                                   "dev_euis": list(dev_euis)}
 
-        if any([not self._rht_lora_app_loc, not self._rht_lora_app_loc,
-                not self._lr210_relay_ch]):
-            raise RuntimeError("Missing loraserver parameters")
-
-        lora_if = loraserver.LoraServerHandler(self._mqtt_host, self._mqtt_port,
-                                               self._mqtt_tls,
-                                               self._mqtt_user, self._mqtt_pass,
-                                               self._rht_lora_app_loc,
-                                               self._lr210_app_app_loc)
+    def load_config(self, path):
+        '''
+        Load the deployment configuration from a JSON file, see config.py.
+        The file is loaded again on reload() or SIGHUP
+        '''
+        self._config = config.load(path)
+        self._config_path = path
 
-        # Set our connect handler
-        lora_if.set_connect_handler(self.mqtt_connect_handler)
+    def reload(self):
+        '''
+        Reload the configuration file and apply the changes, keeps the
+        current configuration if the file is invalid
+        '''
+        if not self._config_path:
+            LOGGER.warning("No config file to reload")
+            return
+        try:
+            new_config = config.load(self._config_path)
+        except (IOError, ValueError, RuntimeError) as exception:
+            LOGGER.error("Config reload failed, keeping current! " + repr(exception))
+            return
+        LOGGER.info("Reloading config " + self._config_path)
+        self._apply_config(new_config)
+
+    def _sighup_handler(self, _signum, _frame):
+        # Only flag here, the reload is done from the main loop
+        self._reload_pending = True
 
-        # Create our RH and tempsensor object
-        rht_sensor = oy1110.RHTSensor()
-        # Connect the UL data handler (DL to OY1110 not used)
-        lora_if.set_rht_sensor_ul_cb(rht_sensor.uplink_data_handler)
+    def mqtt_connect_handler(self):
+        '''
+        Installed as callback when we have connected to LoRa Server MQTT OK
+        '''
+        self._connected = True
+        # Perform a one-time query of the current relay states, once per
+        # device as a LR210 may be shared by zones. Sent also when states
+        # were restored, the relays may have reset since they were saved.
+        # Control does not wait for the reply, restored states are used
+        # until it arrives. Multicast group members report their states in
+        # their next periodic uplink
+        for key in sorted(set(self._device_key(zone_cfg["lr210"])
+                              for zone_cfg in self._applied["zones"].values())):
+            self._devices[key].request_relay_states()
+
+    @staticmethod
+    def _device_key(device_cfg):
+        return (device_cfg["application"], device_cfg["dev_eui"])
+
+    def _register_device(self, key, device):
+        ''' Add a new device to the registry and subscribe to its uplinks '''
+        dl_handler = self._lora_if.add_device(key, device.uplink_data_handler)
+        if isinstance(device, lr210.LR210):
+            device.set_dl_handler(dl_handler)
+            if self._connected:
+                device.request_relay_states()
+        self._devices[key] = device
+
+    def _build_zone(self, zone_cfg, old_zone, devices):
+        '''
+        Create a zone from config using devices, a dict of (application,
+        dev_eui) to device object, keeping the thermostat of old_zone
+        '''
+        rht_sensor = devices[self._device_key(zone_cfg["rht_sensor"])]
+        lr210_ctrl = devices[self._device_key(zone_cfg["lr210"])]
+        thermo = old_zone.thermostat() if old_zone else thermostat.RHTThermostat()
+
+        lr210_group = None
+        mc_cfg = zone_cfg.get("multicast_group")
+        if mc_cfg:
+            members = [devices[(mc_cfg["application"], dev_eui)]
+                       for dev_eui in mc_cfg["dev_euis"]]
+            lr210_group = lr210.LR210Group(members)
+            lr210_group.set_dl_handler(
+                functools.partial(self._lora_if.multicast_dl_handler,
+                                  mc_cfg["group_id"]))
+
+        return Zone(rht_sensor, lr210_ctrl, zone_cfg["lr210"]["channel"],
+                    thermo, lr210_group)
+
+    @staticmethod
+    def _controlled_channels(cfg):
+        ''' Returns a set of (application, dev_eui, channel) driven by zones '''
+        channels = set()
+        for zone_cfg in cfg["zones"].values():
+            lr210_cfg = zone_cfg["lr210"]
+            channels.add((lr210_cfg["application"], lr210_cfg["dev_eui"],
+                          lr210_cfg["channel"]))
+            mc_cfg = zone_cfg.get("multicast_group")
+            if mc_cfg:
+                channels.update((mc_cfg["application"], dev_eui,
+                                 lr210_cfg["channel"])
+                                for dev_eui in mc_cfg["dev_euis"])
+        return channels
+
+    def _apply_config(self, new_config):
+        '''
+        Apply a validated configuration. Only zones with changed config are
+        touched, devices are kept in the registry as long as any zone uses
+        them so relay states and pending commands survive a reload. The new
+        devices and zones are built before any current state is changed
+        '''
+        old_config = self._applied or {"mqtt": new_config["mqtt"],
+                                       "lora_api": {}, "zones": {}}
+
+        # Keep devices still used as the same device type, create the rest
+        device_types = config.device_types(new_config)
+        devices = dict((key, device) for key, device in self._devices.items()
+                       if device_types.get(key) == type(device).__name__)
+        new_devices = dict((key, self._DEVICE_CLASSES[type_name]())
+                           for key, type_name in device_types.items()
+                           if key not in devices)
+        all_devices = dict(devices)
+        all_devices.update(new_devices)
+
+        zones = {}
+        thermo_updates = []
+        for zone_name, zone_cfg in new_config["zones"].items():
+            old_cfg = old_config["zones"].get(zone_name)
+            zone = self._zones.get(zone_name)
+            if zone and zone_cfg == old_cfg:
+                zones[zone_name] = zone
+                continue
+            if zone and all(zone_cfg.get(key) == old_cfg.get(key)
+                            for key in self._ZONE_DEVICE_KEYS):
+                LOGGER.info("Updating zone " + zone_name + " thermostat")
+            else:
+                LOGGER.info("Building zone " + zone_name)
+                zone = self._build_zone(zone_cfg, zone, all_devices)
+            zones[zone_name] = zone
+            thermo_updates.append((zone, zone_cfg["thermostat"]))
+
+        # Everything is built, apply
+        if new_config["mqtt"] != old_config["mqtt"]:
+            LOGGER.warning("MQTT config changed, restart needed to apply")
+        if self._applied and new_config["status"] != old_config["status"]:
+            LOGGER.warning("Status API config changed, restart needed to apply")
+        if new_config["lora_api"] != old_config["lora_api"] and \
+        new_config["lora_api"]["url"]:
+            self._lora_if.set_multicast_api(new_config["lora_api"]["url"],
+                                            new_config["lora_api"]["token"])
+
+        # Relay channels no longer driven by any zone would keep their last
+        # state forever, switch them off. Removed devices get a single
+        # explicit off, their state may be unknown or a command in flight
+        for application, dev_eui, channel in sorted(
+                self._controlled_channels(old_config) -
+                self._controlled_channels(new_config)):
+            key = (application, dev_eui)
+            if key in devices:
+                LOGGER.warning("LR210 %s channel %d no longer controlled, "
+                               "switching off", dev_eui, channel)
+                self._devices[key].set_channel_state([(channel, False)])
+            else:
+                LOGGER.warning("LR210 %s channel %d no longer controlled, "
+                               "switching off without retries", dev_eui, channel)
+                self._devices[key].force_channel_state(channel, False)
+
+        for key in set(self._devices) - set(devices):
+            LOGGER.info("Removing device %s %s", key[0], key[1])
+            self._lora_if.remove_device(key)
+        self._devices = devices
+        for key, device in new_devices.items():
+            self._register_device(key, device)
+
+        for zone_name in set(self._zones) - set(zones):
+            LOGGER.info("Removing zone " + zone_name)
+        self._zones = zones
+        for zone, thermo_cfg in thermo_updates:
+            zone.configure_thermostat(thermo_cfg)
+
+        # Retry policy applies to all relay controllers
+        retry = new_config["retry"]
+        for device in self._devices.values():
+            if isinstance(device, lr210.LR210):
+                device.set_retry_policy(timedelta(minutes=retry["period_minutes"]),
+                                        retry["max_retries"])
+        for zone in self._zones.values():
+            if zone.lr210_group():
+                zone.lr210_group().set_verify_period(
+                    timedelta(minutes=retry["multicast_verify_minutes"]))
+
+        self._applied = new_config
+
+    def _publish_status(self):
+        ''' Publish a status snapshot of all zones and relay controllers '''
+        zones = {}
+        for zone_name, zone_cfg in self._applied["zones"].items():
+            rht_cfg = zone_cfg["rht_sensor"]
+            lr210_cfg = zone_cfg["lr210"]
+            rht_sensor = self._devices[(rht_cfg["application"], rht_cfg["dev_eui"])]
+            lr210_ctrl = self._devices[(lr210_cfg["application"], lr210_cfg["dev_eui"])]
+            thermo_status = self._zones[zone_name].thermostat().status()
+            thermo_status["mode"] = zone_cfg["thermostat"]["mode"]
+            zones[zone_name] = {
+                "rht_sensor": dict(rht_sensor.status(),
+                                   dev_eui=rht_cfg["dev_eui"]),
+                "thermostat": thermo_status,
+                "lr210": lr210_cfg["dev_eui"],
+                "channel": lr210_cfg["channel"],
+                "relay": lr210_ctrl.channel(lr210_cfg["channel"]).status(),
+                "multicast_group": zone_cfg.get("multicast_group", {}).get("group_id"),
+            }
+
+        lr210_devices = dict((key[1], device.status())
+                             for key, device in self._devices.items()
+                             if isinstance(device, lr210.LR210))
+
+        self._status_server.publish({"zones": zones, "lr210": lr210_devices})
+
+    def _state(self):
+        ''' Returns a dict of device and thermostat state to save '''
+        return {"devices": [{"application": key[0], "dev_eui": key[1],
+                             "state": device.save_state()}
+                            for key, device in sorted(self._devices.items())],
+                "thermostats": dict((zone_name, zone.thermostat().output())
+                                    for zone_name, zone in self._zones.items())}
+
+    def _save_state(self):
+        ''' Save device and thermostat state if changed since last save '''
+        state = self._state()
+        if state == self._saved_state:
+            return
+        state_file = self._applied["state_file"]
+        try:
+            # Write and rename, never leaving a partly written state file
+            with open(state_file + ".tmp", "w") as tmp_file:
+                json.dump(state, tmp_file)
+            os.rename(state_file + ".tmp", state_file)
+            self._saved_state = state
+        except (IOError, OSError) as exception:
+            LOGGER.error("Failed to save state! " + repr(exception))
+
+    def _load_state(self):
+        '''
+        Restore device and thermostat state saved by a previous run, so we
+        can control without waiting for the devices to report
+        '''
+        state_file = self._applied["state_file"]
+        if not os.path.exists(state_file):
+            return
+        try:
+            with open(state_file) as saved_file:
+                state = json.load(saved_file)
+            devices = state["devices"]
+            thermostats = state["thermostats"]
+            if not isinstance(devices, list) or not isinstance(thermostats, dict):
+                raise ValueError("Invalid state file")
+        except (IOError, ValueError, KeyError, TypeError) as exception:
+            LOGGER.warning("Failed to load state, starting without! " + repr(exception))
+            return
+
+        # Each entry is checked before it is applied, invalid ones are skipped
+        for device_state in devices:
+            try:
+                device = self._devices.get((device_state["application"],
+                                            device_state["dev_eui"]))
+                if device:
+                    device.restore_state(device_state["state"])
+            except (ValueError, KeyError, TypeError, AttributeError) as exception:
+                LOGGER.warning("Ignoring invalid saved device state! " + repr(exception))
+        for zone_name, output in thermostats.items():
+            if zone_name in self._zones and isinstance(output, bool):
+                self._zones[zone_name].thermostat().restore_output(output)
+
+    def run(self, startup_timer=None):
+        '''
+        Run the main controller, will not return until severe errors occurs.
+        Startup phases are measured and reported with startup_timer
+        '''
+        startup_timer = startup_timer or StartupTimer()
+        new_config = config.validate(self._config)
+
+        # Imported here, thermostats and zones are usable without paho
+        import loraserver
+
+        mqtt_cfg = new_config["mqtt"]
+        self._lora_if = loraserver.LoraServerHandler(mqtt_cfg["host"],
+                                                     mqtt_cfg["port"],
+                                                     mqtt_cfg["tls"],
+                                                     mqtt_cfg["username"],
+                                                     mqtt_cfg["password"])
+
+        # Set our connect handler and connect while we set up the rest
+        self._lora_if.set_connect_handler(self.mqtt_connect_handler)
+        self._lora_if.connect_background()
+
+        # Create zones, sensors and relay controllers
+        self._apply_config(new_config)
+        startup_timer.mark("zones")
+
+        if new_config["state_file"]:
+            self._load_state()
+            startup_timer.mark("state")
+
+        if self._config_path and hasattr(signal, "SIGHUP"):
+            signal.signal(signal.SIGHUP, self._sighup_handler)
+
+        status_cfg = new_config["status"]
+        if status_cfg["port"]:
+            # Only imported when used, pulls in the HTTP server modules
+            import status
+            self._status_server = status.StatusServer(status_cfg["host"],
+                                                      status_cfg["port"])
+            self._publish_status()
+            self._status_server.start()
+            startup_timer.mark("status")
+
+        self._lora_if.connect_subscribe()
+        startup_timer.mark("mqtt")
+        startup_timer.report()
 
-        # Create the LR210 relay controller object
-        self._lr210_ctrl = lr210.LR210()
+        lora_if_result = True
+        while lora_if_result:
+            lora_if_result = self._lora_if.run_loop()
 
-        # Connect the UL and DL data handlers
-        lora_if.set_lr210_ul_cb(self._lr210_ctrl.uplink_data_handler)
-        self._lr210_ctrl.set_dl_handler(lora_if.lr210_dl_handler)
+            if self._reload_pending:
+                self._reload_pending = False
+                self.reload()
 
-        # Create out thermostat
-        thermo = RHTThermostat(-15.0, 80.0)
+            for zone in self._zones.values():
+                zone.control()
 
-        lora_if_result = True
-        while lora_if_result:
-            lora_if_result = lora_if.run_loop()
+            for key, device in self._devices.items():
+                if not isinstance(device, lr210.LR210):
+                    continue
 
-            # Feed the thermostat new values
-            thermo.update_actual_values(rht_sensor.humidity(),
-                                        rht_sensor.temperature())
+                # Poll the relay controller if retries are needed
+                device.periodic_poll()
 
-            # Send the termostat output to the relay controller
-            if thermo.output_active():
-                self._lr210_ctrl.set_channel_state([(self._lr210_relay_ch,
-                                                     thermo.output())])
+                # Check LR210 internal temperature
+                if device.temperature() and device.temperature() > 55.0:
+                    LOGGER.warning("LR210 %s internal temp high!", key[1])
 
-            # Poll the relay controller if retries are needed
-            self._lr210_ctrl.periodic_poll()
+            if self._status_server:
+                self._publish_status()
 
-            # Check LR210 internal temperature
-            if self._lr210_ctrl.temperature() and self._lr210_ctrl.temperature() > 55.0:
-                LOGGER.warning("LR210 internal temp high!")
+            if self._applied["state_file"]:
+                self._save_state()
@@ -15,37 +15,96 @@ heaterCtrl is a a control application using LoRaWAN LR210 controller and OY110 R
 @deffield    updated: Updated
 '''
 
+import time
+
+# Start of the startup time measurement, before any other imports. The
+# imports below are intentionally placed after it to be included in the
+# measured startup time, do not move them to the top
+START_TIME = time.time()
+
+# pylint: disable=wrong-import-position
 import sys
 import os
+import logging
+import argparse
 import traceback
-import subprocess
 import controller
+# pylint: enable=wrong-import-position
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+VERSION_FILE = os.path.join(BASE_DIR, "_version.py")
 
 def get_git_revision_hash():
     ''' get full git revision as bytes '''
-    return subprocess.check_output(['git', 'rev-parse', 'HEAD'])
+    import subprocess
+    return subprocess.check_output(['git', 'rev-parse', 'HEAD'], cwd=BASE_DIR)
 
 def get_git_revision_short_hash():
     ''' get short git revision as bytes '''
-    return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'])
+    import subprocess
+    return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'],
+                                   cwd=BASE_DIR)
+
+def stamp_version():
+    ''' Write the git revision to the version file, run at build/deploy time '''
+    with open(VERSION_FILE, "w") as version_file:
+        version_file.write("# Generated by heaterctrl.py --stamp-version\n")
+        version_file.write("REVISION = %r\n" %
+                           get_git_revision_hash().decode('ascii').strip())
+        version_file.write("SHORT_REVISION = %r\n" %
+                           get_git_revision_short_hash().decode('ascii').strip())
+
+def get_revision():
+    '''
+    Get short revision, stamped at build time or from git when running
+    from a work tree
+    '''
+    try:
+        from _version import SHORT_REVISION
+        return SHORT_REVISION
+    except ImportError:
+        pass
+    if os.path.isdir(os.path.join(BASE_DIR, ".git")):
+        import subprocess
+        try:
+            return get_git_revision_short_hash().decode('ascii').strip()
+        except (OSError, subprocess.CalledProcessError):
+            pass
+    return "unknown"
 
 def main():
     '''Main controller application'''
 
     program_name = os.path.basename(sys.argv[0])
-    sys.stdout.write(program_name + " rev: " +
-                     get_git_revision_short_hash().decode('ascii').strip() +
-                     " starting\n")
+    default_config = os.path.join(BASE_DIR, "heaterctrl.json")
+
+    parser = argparse.ArgumentParser(description="Control heater based on RH input data")
+    parser.add_argument("-c", "--config", default=default_config,
+                        help="deployment config file, reloaded on SIGHUP "
+                        "(default: %(default)s)")
+    parser.add_argument("--stamp-version", action="store_true",
+                        help="write the git revision to " +
+                        os.path.basename(VERSION_FILE) + " and exit")
+    args = parser.parse_args()
+
+    if args.stamp_version:
+        stamp_version()
+        return 0
+
+    logging.basicConfig(level=logging.INFO)
+    startup_timer = controller.StartupTimer(START_TIME)
+    startup_timer.mark("imports")
+
+    sys.stdout.write(program_name + " rev: " + get_revision() + " starting\n")
 
     try:
         # Setup the main controller class
         climate_ctrl = controller.ClimateController()
-        climate_ctrl.mqtt_server_params("lorans.home.dnil.se", 1883)
-        climate_ctrl.lr210_relay_ctrl("application/20", "70b3d5d72ffc8000", 1)
-        climate_ctrl.rht_sensor_data("application/6", "70b3d5d7201c0029")
+        climate_ctrl.load_config(args.config)
+        startup_timer.mark("config")
 
         # Run program
-        climate_ctrl.run()
+        climate_ctrl.run(startup_timer)
 
     except Exception as exception:
         sys.stderr.write(program_name + ": " + repr(exception) + "\n")
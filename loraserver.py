@@ -7,11 +7,15 @@ import ssl
 import json
 import base64
 import logging
+import functools
+import threading
 import paho.mqtt.client as mqtt
 
-logging.basicConfig(level=logging.INFO)
 LOGGER = logging.getLogger(__name__)
 
+# Seconds, the multicast API call blocks uplink processing meanwhile
+MULTICAST_API_TIMEOUT = 2
+
 def data_port_from_payload(payload):
     ''' Extract payload data as bytearray and port from payload '''
     data_arr = []
@@ -32,8 +36,7 @@ class LoraServerHandler(mqtt.Client):
     '''
 
     def __init__(self, mqtt_host, mqtt_port, mqtt_tls_mode,
-                 mqtt_user, mqtt_pass,
-                 rht_lora_app, lr210_lora_app):
+                 mqtt_user, mqtt_pass):
         '''
         Constructor
         '''
@@ -46,57 +49,100 @@ class LoraServerHandler(mqtt.Client):
         self._tls_support = mqtt_tls_mode
         self._user = mqtt_user
         self._pass = mqtt_pass
-        self._rht_lora = rht_lora_app
-        self._lr210_lora = lr210_lora_app
         self._mqtt_connected = False
-        self._rht_uplink_handler = None
-        self._lr210_uplink_handler = None
         self._connect_handler = None
+        # Device RX topic -> (application, dev_eui) tuple
+        self._devices = {}
+        self._api_url = None
+        self._api_token = None
+        self._connect_thread = None
+        self._connect_error = None
 
     def set_connect_handler(self, callback):
         ''' Set callback used when we have connected to MQTT broker OK '''
         self._connect_handler = callback
 
-    def set_rht_sensor_ul_cb(self, callback):
-        ''' Set callback to handle RHT sensor UL data '''
-        self._rht_uplink_handler = callback
+    def set_multicast_api(self, api_url, api_token):
+        '''
+        Setup LoRa Server REST API base URL and API token, needed for
+        multicast group downlinks which are not available over MQTT
+        '''
+        self._api_url = api_url.rstrip("/")
+        self._api_token = api_token
 
-    def lr210_dl_handler(self, data):
-        ''' Send downlink to LR210 from a tuple of bytearray and port '''
+    def _publish_dl(self, lora_app, data):
         if self._mqtt_connected:
-            lr210pub = self._lr210_lora[0] + "/node/" + self._lr210_lora[1] + "/tx"
+            pub = lora_app[0] + "/node/" + lora_app[1] + "/tx"
             b64_data = base64.b64encode(data[0])
             b64_str = b64_data.decode('utf-8')
             tx_object = {"confirmed": True, "fPort": data[1], "data":b64_str}
-            self.publish(lr210pub, json.dumps(tx_object))
+            self.publish(pub, json.dumps(tx_object))
         else:
             LOGGER.error("Not connected! Omitting send!")
 
-    def set_lr210_ul_cb(self, callback):
-        ''' Set callback to handle RL210 UL data '''
-        self._lr210_uplink_handler = callback
-
-    def on_lr210_data(self, _mosq, _obj, msg):
-        ''' Act on MQTT data matching LR210 RX topic '''
-
-        # This callback will only be called for LR210 RX data
-        LOGGER.info("LR210 uplink data: " + msg.topic + " " + str(msg.qos) + " " + str(msg.payload))
-        ul_data = data_port_from_payload(msg.payload)
-        if self._lr210_uplink_handler:
-            self._lr210_uplink_handler(ul_data)
-        else:
-            LOGGER.error("No UL data handler for LR210 data?")
+    @staticmethod
+    def _rx_topic(lora_app):
+        return lora_app[0] + "/node/" + lora_app[1] + "/rx"
 
-    def on_rht_sensor_data(self, _mosq, _obj, msg):
-        ''' Act on MQTT data matching RHT RX topic '''
-
-        # This callback will only be called for RHT sensor data
-        LOGGER.info("RHT uplink data: " + msg.topic + " " + str(msg.qos) + " " + str(msg.payload))
-        ul_data = data_port_from_payload(msg.payload)
-        if self._rht_uplink_handler:
-            self._rht_uplink_handler(ul_data)
-        else:
-            LOGGER.error("No UL data handler for RHT data?")
+    def add_device(self, lora_app, callback):
+        '''
+        Add a device (application, dev_eui) with its UL data callback,
+        taking a tuple of bytearray and port. Returns the DL handler for the
+        device. May be called while connected, the RX topic is then
+        subscribed directly
+        '''
+        rxsub = self._rx_topic(lora_app)
+        self._devices[rxsub] = lora_app
+        self.message_callback_add(rxsub,
+                                  functools.partial(self.on_device_data, callback))
+        if self._mqtt_connected:
+            self.subscribe(rxsub, 2)
+        return functools.partial(self._publish_dl, lora_app)
+
+    def remove_device(self, lora_app):
+        ''' Remove a device (application, dev_eui) and its subscription '''
+        rxsub = self._rx_topic(lora_app)
+        if self._devices.pop(rxsub, None):
+            self.message_callback_remove(rxsub)
+            if self._mqtt_connected:
+                self.unsubscribe(rxsub)
+
+    def multicast_dl_handler(self, group_id, data):
+        '''
+        Enqueue a multicast group downlink from a tuple of bytearray and port,
+        returns True if it was enqueued. Runs on the MQTT loop thread, so
+        the API call has a short timeout
+        '''
+        if not self._api_url:
+            LOGGER.error("No LoRa Server API configured! Omitting multicast!")
+            return False
+
+        # Only needed for multicast, imported on first use
+        try:
+            from urllib.request import Request, urlopen
+        except ImportError:
+            from urllib2 import Request, urlopen
+
+        url = self._api_url + "/api/multicast-groups/" + group_id + "/queue"
+        b64_str = base64.b64encode(data[0]).decode('utf-8')
+        queue_item = {"multicastQueueItem": {"multicastGroupID": group_id,
+                                             "fPort": data[1],
+                                             "data": b64_str}}
+        request = Request(url, data=json.dumps(queue_item).encode('utf-8'),
+                          headers={"Content-Type": "application/json",
+                                   "Grpc-Metadata-Authorization":
+                                   "Bearer " + self._api_token})
+        try:
+            urlopen(request, timeout=MULTICAST_API_TIMEOUT).close()
+        except IOError as exception:
+            LOGGER.error("Multicast enqueue failed! " + repr(exception))
+            return False
+        return True
+
+    def on_device_data(self, callback, _mosq, _obj, msg):
+        ''' Act on MQTT data matching a device RX topic '''
+        LOGGER.info("Uplink data: " + msg.topic + " " + str(msg.qos) + " " + str(msg.payload))
+        callback(data_port_from_payload(msg.payload))
 
     def on_message(self, _mosq, _obj, msg):
         ''' This callback will be called for messages that we receive that do not
@@ -114,26 +160,49 @@ class LoraServerHandler(mqtt.Client):
         else:
             raise RuntimeError("MQTT connection failed!")
 
-    def connect_subscribe(self):
-        ''' Perform the connect and subscribe procedure towards the broker '''
-        if not self._mqtt_connected:
-            self.enable_logger(LOGGER)
+    def _connect_broker(self):
+        self.enable_logger(LOGGER)
 
-            if any([self._user, self._pass]):
-                self.username_pw_set(self._user, self._pass)
+        if any([self._user, self._pass]):
+            self.username_pw_set(self._user, self._pass)
 
-            if self._tls_support:
-                self.tls_set(tls_version=ssl.PROTOCOL_TLSv1_2)
+        if self._tls_support:
+            self.tls_set(tls_version=ssl.PROTOCOL_TLSv1_2)
 
-            lr210sub = self._lr210_lora[0] + "/node/" + self._lr210_lora[1] + "/rx"
-            rhtsub = self._rht_lora[0] + "/node/" + self._rht_lora[1] + "/rx"
+        LOGGER.info("Connecting to %s:%d", self._host, self._port)
+        self.connect(self._host, self._port, 60)
 
-            self.message_callback_add(lr210sub, self.on_lr210_data)
-            self.message_callback_add(rhtsub, self.on_rht_sensor_data)
+    def _connect_broker_thread(self):
+        try:
+            self._connect_broker()
+        except Exception as exception:
+            self._connect_error = exception
 
-            LOGGER.info("Connecting to %s:%d", self._host, self._port)
-            self.connect(self._host, self._port, 60)
-            self.subscribe([(lr210sub, 2), (rhtsub, 2)], 0)
+    def connect_background(self):
+        '''
+        Start connecting to the broker in a background thread, so the
+        application can load config and state meanwhile. Devices may still
+        be added, connect_subscribe waits for the connection and subscribes
+        '''
+        if not self._mqtt_connected and not self._connect_thread:
+            self._connect_thread = threading.Thread(target=self._connect_broker_thread,
+                                                    name="mqtt-connect")
+            self._connect_thread.daemon = True
+            self._connect_thread.start()
+
+    def connect_subscribe(self):
+        ''' Perform the connect and subscribe procedure towards the broker '''
+        if not self._mqtt_connected:
+            if self._connect_thread:
+                self._connect_thread.join()
+                self._connect_thread = None
+                if self._connect_error:
+                    raise self._connect_error
+            else:
+                self._connect_broker()
+
+            if self._devices:
+                self.subscribe([(rxsub, 2) for rxsub in self._devices], 0)
             self._mqtt_connected = True
 
     def run_loop(self):
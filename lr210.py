@@ -6,23 +6,32 @@ Created on Feb 23, 2020
 
 from datetime import datetime, timedelta
 import logging
+import codec
 
-logging.basicConfig(level=logging.INFO)
 LOGGER = logging.getLogger(__name__)
 
+# Timestamp format in saved state
+STATE_TS_FORMAT = "%Y-%m-%dT%H:%M:%S.%f"
+
 class DownlinkSetCommand(object):
     ''' Object representing a LoRa Downlink Relay Set Command '''
 
-    def __init__(self, relay_set_data):
+    def __init__(self, relay_set_data, multicast_period=None,
+                 retry_period=timedelta(minutes=5), retry_max=5):
         '''
-        Constructor intended to be called when the command is first sent
+        Constructor intended to be called when the command is first sent.
+        Commands sent in a multicast group downlink set multicast_period
+        (timedelta) to the time we wait for the device to report back
         '''
         self._is_pending = False
         self._rly_set_data = relay_set_data
         self._retry_count = 0
         self._last_send_timestamp = datetime.now()
-        self._retry_period = timedelta(minutes=5)
-        self._retry_max = 5
+        self._retry_period = retry_period
+        self._retry_max = retry_max
+        self._multicast = multicast_period is not None
+        if self._multicast:
+            self._retry_period = multicast_period
 
     def increase_retry(self):
         '''
@@ -55,12 +64,27 @@ class DownlinkSetCommand(object):
         '''
         return self._rly_set_data == relay_set_data
 
+    def is_multicast(self):
+        '''
+        Returns True if this command was sent in a multicast group downlink
+        '''
+        return self._multicast
+
     def resend_due(self):
         '''
         Returns True is a resend is due
         '''
         return self._last_send_timestamp + self._retry_period < datetime.now()
 
+    def status(self):
+        '''
+        Returns a dict describing this command, for status reporting
+        '''
+        return {"cmd": "0x%08x" % self._rly_set_data,
+                "retry_count": self._retry_count,
+                "multicast": self._multicast,
+                "last_send": self._last_send_timestamp.isoformat()}
+
 class RelayChannel(object):
     '''
     Object representing one relay channel
@@ -123,6 +147,13 @@ class RelayChannel(object):
 
         self._req_state = req_state
 
+    def status(self):
+        '''
+        Returns a dict of actual and requested state, "active", "deactive"
+        or None if unknown
+        '''
+        return {"actual": self._act_state, "requested": self._req_state}
+
     def ch_change_required(self):
         '''
         Returns a tuple containing True/False if change is needed followed
@@ -163,8 +194,14 @@ class LR210(object):
 
         self._downlink_handler = None
 
-        # DL command pending object
+        # DL command pending object and its retry policy
         self._dl_pend_cmd = None
+        self._retry_period = timedelta(minutes=5)
+        self._retry_max = 5
+
+        # Reusable buffer for relay set commands
+        self._dl_set_buf = codec.new_buffer(codec.LR210, codec.PROTOCOL_PORT,
+                                            codec.CMD_SET, codec.IDX_RELAY_STATE)
 
     def uplink_data_handler(self, data):
         '''
@@ -173,39 +210,31 @@ class LR210(object):
         '''
         # Periodic data is sent on port 2,
         # Protocol response data is sent on port 1
-        data_arr = data[0]
-        port = data[1]
-        if port == 2:
-            # we expect a 32-bit big endian integer here
-            if len(data_arr) == 4:
-                # Update actual relay channel states
-                relay_data = int(data_arr[0]) << 8 | int(data_arr[1])
-                for ch_index, channel in self._channels.items():
-                    channel.set_actual((relay_data & (1 << (ch_index-1))) != 0)
-
-                # Update internal temperature data
-                temp_data = int(data_arr[2]) << 8 | int(data_arr[3])
-                self._temp = (temp_data / 10.0) - 80.0
-
-                # Update the timestamp on current data
-                self._temp_state_ts = datetime.now()
-
-                # Clear any pending commands
-                self._dl_pend_cmd = None
-            else:
-                LOGGER.error("Unexpected data length!")
-        elif port == 1:
-            # Protocol data deconding not fully implemented
-            if len(data_arr) >= 2:
-                if data_arr[0] == 0x01:
-                    # Data
-                    if data_arr[1] == 0x22:
-                        # Relay status
-                        relay_data = int(data_arr[2]) << 8 | int(data_arr[3])
-                        for ch_index, channel in self._channels.items():
-                            channel.set_actual((relay_data & (1 << (ch_index-1))) != 0)
+        msg = codec.decode(codec.LR210, data[1], data[0])
+        if msg is None:
+            return
+
+        name, values = msg
+        if name == "periodic":
+            # Update actual relay channel states
+            self._set_actual_states(values["relay"])
+
+            # Update internal temperature data
+            self._temp = values["temperature"]
+
+            # Update the timestamp on current data
+            self._temp_state_ts = datetime.now()
+
+            # Clear any pending commands
+            self._dl_pend_cmd = None
+        elif name == "relay_state":
+            self._set_actual_states(values["relay"])
         else:
-            LOGGER.error("Unknown port in UL data: %s", str(port))
+            LOGGER.info("Unhandled LR210 protocol response: %s", str(values))
+
+    def _set_actual_states(self, relay_data):
+        for ch_index, channel in self._channels.items():
+            channel.set_actual((relay_data & (1 << (ch_index-1))) != 0)
 
     def _check_max_data_age(self):
         if self._temp_state_ts and \
@@ -216,22 +245,21 @@ class LR210(object):
                 channel.reset_state()
 
     def _send_lora_relay_set_cmd(self, cmd_data):
-        # We should send our command, 6 bytes needed
-        dl_command = bytearray(6)
-        dl_command[0] = 0x01 # set command
-        dl_command[1] = 0x22 # relay state index
-        dl_command[2] = (cmd_data >> 24) & 0xFF # big endian data
-        dl_command[3] = (cmd_data >> 16) & 0xFF
-        dl_command[4] = (cmd_data >> 8) & 0xFF
-        dl_command[5] = (cmd_data >> 0) & 0xFF
-
-        # All DL command on dl_port 1
-        dl_port = 1
+        # All DL command on the protocol port
+        dl_port = codec.PROTOCOL_PORT
         if self._downlink_handler:
+            # The DL handler consumes the data before returning, so the
+            # command buffer can be reused for every send
+            dl_command = codec.pack_into(self._dl_set_buf, codec.LR210, dl_port,
+                                         codec.CMD_SET, codec.IDX_RELAY_STATE,
+                                         cmd_data)
+
             # If this is the first time we send the command, create an object
             # representing the command
-            if not self._dl_pend_cmd:
-                self._dl_pend_cmd = DownlinkSetCommand(cmd_data)
+            if not self._dl_pend_cmd or not self._dl_pend_cmd.cmd_is_equal(cmd_data):
+                self._dl_pend_cmd = DownlinkSetCommand(cmd_data, None,
+                                                       self._retry_period,
+                                                       self._retry_max)
 
             # Send it over LoRa
             self._downlink_handler((dl_command, dl_port))
@@ -256,9 +284,16 @@ class LR210(object):
         # Change is needed, do we have a pending command equal to what we
         # would like to send now ?
         if self._dl_pend_cmd and self._dl_pend_cmd.cmd_is_equal(cmd_data):
-            # Change is pending, no need to send again (yet)
+            # Change is pending, no need to send again (yet). A multicast
+            # command is verified by the next uplink, no unicast until that
+            # uplink is received or the command has timed out
             return
 
+        if self._dl_pend_cmd and self._dl_pend_cmd.is_multicast():
+            # Change not covered by the multicast command, e.g. on another
+            # channel, unicast takes over at once
+            self._dl_pend_cmd = None
+
         # Send our new command
         self._send_lora_relay_set_cmd(cmd_data)
 
@@ -266,11 +301,83 @@ class LR210(object):
         ''' Register a DL data handler '''
         self._downlink_handler = handler
 
+    def set_retry_policy(self, retry_period, retry_max):
+        '''
+        Override default retry period (timedelta) and max retry count, used
+        for new DL set commands
+        '''
+        self._retry_period = retry_period
+        self._retry_max = retry_max
+
+    def channel(self, channel):
+        ''' Returns the RelayChannel object of channel (1 or 2) '''
+        if channel not in self._channels:
+            raise RuntimeError("Invalid channel requested!")
+        return self._channels[channel]
+
     def temperature(self):
         ''' Returns temp current relay controller internal temperature '''
         self._check_max_data_age()
         return self._temp
 
+    def status(self):
+        '''
+        Returns a dict of temperature, relay channel states, pending command
+        and time of the last data uplink, for status reporting
+        '''
+        self._check_max_data_age()
+        data_time = None
+        if self._temp_state_ts:
+            data_time = self._temp_state_ts.isoformat()
+        pending = None
+        if self._dl_pend_cmd:
+            pending = self._dl_pend_cmd.status()
+        return {"temperature": self._temp,
+                "data_time": data_time,
+                "channels": dict((str(ch_index), channel.status())
+                                 for ch_index, channel in self._channels.items()),
+                "pending_command": pending}
+
+    def save_state(self):
+        '''
+        Returns a dict of the current data and actual relay states, to be
+        restored with restore_state after a restart
+        '''
+        if not self._temp_state_ts:
+            return {}
+        return {"timestamp": self._temp_state_ts.strftime(STATE_TS_FORMAT),
+                "temperature": self._temp,
+                "channels": dict((str(ch_index), channel.status()["actual"])
+                                 for ch_index, channel in self._channels.items())}
+
+    def restore_state(self, state):
+        '''
+        Restore a state saved by save_state, data older than the max data
+        age is dropped as usual. Raises ValueError, KeyError or TypeError on
+        an invalid state, leaving the current state as is
+        '''
+        if not isinstance(state, dict):
+            raise ValueError("Invalid LR210 state")
+        if not state.get("timestamp"):
+            return
+        timestamp = datetime.strptime(state["timestamp"], STATE_TS_FORMAT)
+        temperature = state["temperature"]
+        channels = state["channels"]
+        if not (temperature is None or (isinstance(temperature, (int, float)) and
+                                        not isinstance(temperature, bool))) or \
+        not isinstance(channels, dict) or \
+        not all(channels.get(str(ch_index)) in (None, "active", "deactive")
+                for ch_index in self._channels):
+            raise ValueError("Invalid LR210 state")
+
+        self._temp_state_ts = timestamp
+        self._temp = temperature
+        for ch_index, channel in self._channels.items():
+            actual = channels.get(str(ch_index))
+            if actual:
+                channel.set_actual(actual == "active")
+        self._check_max_data_age()
+
     def relay_states(self):
         ''' Returns a string of all current relay states '''
         state_list = []
@@ -281,12 +388,9 @@ class LR210(object):
 
     def request_relay_states(self):
         ''' Send a query over LoRa to read current relay states '''
-        # 2 bytes needed for a query command
-        dl_command = bytearray(2)
-        dl_command[0] = 0x02 # query command
-        dl_command[1] = 0x22 # relay state index
-
-        port = 1 # All DL commands on port 1
+        port = codec.PROTOCOL_PORT # All DL commands on port 1
+        dl_command = codec.encode(codec.LR210, port, codec.CMD_QUERY,
+                                  codec.IDX_RELAY_STATE)
         if self._downlink_handler:
             # Send it over LoRa
             self._downlink_handler((dl_command, port))
@@ -315,12 +419,131 @@ class LR210(object):
         # in case no update is needed nothing is sent
         self._channel_relay_set_data()
 
+    def force_channel_state(self, channel, state):
+        '''
+        Send a relay set command for channel (1 or 2) and state True
+        (active) or False (deactive) whatever the known actual state,
+        replacing any pending command
+        '''
+        self.channel(channel).set_requested(state)
+        cmd_data = 1 << (16 + channel - 1)
+        if state:
+            cmd_data |= 1 << (channel - 1)
+        self._dl_pend_cmd = None
+        self._send_lora_relay_set_cmd(cmd_data)
+
+    def change_required(self):
+        '''
+        Returns True if any channel differs from its requested state
+        '''
+        return any(channel.ch_change_required()[0]
+                   for channel in self._channels.values())
+
+    def multicast_sent(self, cmd_data, verify_period):
+        '''
+        Called when a relay set command (integer) has been sent to this
+        device in a multicast group downlink. Unicast for the channels of
+        the command is held back until the next uplink, or verify_period
+        (timedelta) has passed. A pending unicast command is kept along
+        with its retries
+        '''
+        if self._dl_pend_cmd and not self._dl_pend_cmd.is_multicast():
+            return
+        self._dl_pend_cmd = DownlinkSetCommand(cmd_data, verify_period)
+
     def periodic_poll(self):
         ''' Call this periodically to check retry commands '''
-        if self._dl_pend_cmd and self._dl_pend_cmd.resend_due():
+        if self._dl_pend_cmd and self._dl_pend_cmd.is_multicast():
+            if self._dl_pend_cmd.resend_due():
+                # No uplink after the multicast, fall back to unicast
+                LOGGER.warning("LR210 multicast not verified, using unicast")
+                self._dl_pend_cmd = None
+                self._channel_relay_set_data()
+        elif self._dl_pend_cmd and self._dl_pend_cmd.resend_due():
             # Check if this was the final attempt
             if not self._dl_pend_cmd.retry_ok():
                 self._dl_pend_cmd = None
             else:
                 self._dl_pend_cmd.increase_retry()
                 self._send_lora_relay_set_cmd(self._dl_pend_cmd.cmd())
+
+
+class LR210Group(object):
+    '''
+    Multicast group of LR210 relay controllers sharing a common relay
+    state. A single group downlink is sent for the whole group, each device
+    then verifies its state through its next uplink and devices that did
+    not follow are retried by unicast
+    '''
+
+    def __init__(self, members, verify_period=timedelta(minutes=70),
+                 min_multicast=2):
+        '''
+        Constructor, members is a list of LR210 objects in the multicast
+        group. verify_period should cover the periodic uplink interval of
+        the devices. A multicast is only sent if at least min_multicast
+        devices need a change, otherwise unicast is used
+        '''
+        self._members = list(members)
+        self._verify_period = verify_period
+        self._min_multicast = min_multicast
+        self._downlink_handler = None
+        self._last_mc_cmd = None
+
+    def set_dl_handler(self, handler):
+        '''
+        Register a multicast group DL data handler, returning True if the
+        downlink was sent
+        '''
+        self._downlink_handler = handler
+
+    def set_verify_period(self, verify_period):
+        ''' Override default multicast verify period (timedelta) '''
+        self._verify_period = verify_period
+
+    def members(self):
+        ''' Returns the list of LR210 objects in this group '''
+        return self._members
+
+    def set_channel_state(self, new_channel_states):
+        '''
+        Set the requested relay channels of all devices in the group,
+        same format as LR210.set_channel_state
+        '''
+        cmd_data = 0
+        for channel, state in new_channel_states:
+            # Set the mask from bit 16 and up followed by the data bit
+            cmd_data |= 1 << (16 + channel - 1)
+            if state:
+                cmd_data |= 1 << (channel - 1)
+
+        # Update requested states without triggering any unicast
+        for member in self._members:
+            for channel, state in new_channel_states:
+                member.channel(channel).set_requested(state)
+
+        to_change = [member for member in self._members
+                     if member.change_required()]
+
+        if to_change and cmd_data != self._last_mc_cmd and \
+        len(to_change) >= self._min_multicast and self._downlink_handler:
+            LOGGER.info("LR210 group multicast to %d devices", len(to_change))
+            dl_command = codec.encode(codec.LR210, codec.PROTOCOL_PORT,
+                                      codec.CMD_SET, codec.IDX_RELAY_STATE,
+                                      cmd_data)
+            # Not retried as multicast if it fails, unicast takes over
+            self._last_mc_cmd = cmd_data
+            if self._downlink_handler((dl_command, codec.PROTOCOL_PORT)):
+                for member in to_change:
+                    member.multicast_sent(cmd_data, self._verify_period)
+            else:
+                LOGGER.warning("LR210 group multicast failed, using unicast")
+
+        # Remaining devices, unicast where needed and not already pending
+        for member in self._members:
+            member.set_channel_state(new_channel_states)
+
+    def periodic_poll(self):
+        ''' Call this periodically to check retry commands '''
+        for member in self._members:
+            member.periodic_poll()
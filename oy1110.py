@@ -6,10 +6,14 @@ Created on Feb 23, 2020
 
 from datetime import datetime, timedelta
 import logging
+import binascii
+import codec
 
-logging.basicConfig(level=logging.INFO)
 LOGGER = logging.getLogger(__name__)
 
+# Timestamp format in saved state
+STATE_TS_FORMAT = "%Y-%m-%dT%H:%M:%S.%f"
+
 class RHTSensor(object):
     '''
     Payload decoder for Talkpool OY1110 Temp and Humidity LoRa sensor
@@ -31,24 +35,20 @@ class RHTSensor(object):
         '''
         # Periodic data is sent on port 2,
         # Protocol response data is sent on port 1
-        data_arr = data[0]
-        port = data[1]
-        if port == 2:
-            # Peridic data
-            if len(data_arr) == 3:
-                self._temp = int(data_arr[0]) << 4 | (int(data_arr[2]) >> 4)
-                self._temp = (self._temp - 800) / 10.0
-                self._humi = int(data_arr[1]) << 4 | (int(data_arr[2]) & 0xF)
-                self._humi = (self._humi - 250) / 10.0
-                self._temp_humi_ts = datetime.now()
-                LOGGER.info("Temperature: %f Humidity: %f", self._temp, self._humi)
-            else:
-                LOGGER.error("Only ungrouped data of length 3 supported")
-        elif port == 1:
-            # Protocol data deconding not implemented yet
-            pass
+        msg = codec.decode(codec.OY1110, data[1], data[0])
+        if msg is None:
+            return
+
+        name, values = msg
+        if name == "periodic":
+            self._temp = values["temperature"]
+            self._humi = values["humidity"]
+            self._temp_humi_ts = datetime.now()
+            LOGGER.info("Temperature: %f Humidity: %f", self._temp, self._humi)
         else:
-            LOGGER.error("Unknown port in UL data: %d", port)
+            LOGGER.info("OY1110 protocol response: command 0x%02x index 0x%02x data %s",
+                        values["command"], values["index"],
+                        binascii.hexlify(values["data"]).decode('ascii'))
 
     def _check_max_data_age(self):
         time_now = datetime.now()
@@ -62,7 +62,53 @@ class RHTSensor(object):
         self._check_max_data_age()
         return self._temp
 
+    def timestamp(self):
+        ''' Return time (datetime) of the last uplink with data, or None '''
+        return self._temp_humi_ts
+
     def humidity(self):
         ''' Return current humidity (if known) else None '''
         self._check_max_data_age()
         return self._humi
+
+    def status(self):
+        '''
+        Returns a dict of current values and time of the last data uplink,
+        for status reporting
+        '''
+        self._check_max_data_age()
+        data_time = None
+        if self._temp_humi_ts:
+            data_time = self._temp_humi_ts.isoformat()
+        return {"temperature": self._temp, "humidity": self._humi,
+                "data_time": data_time}
+
+    def save_state(self):
+        '''
+        Returns a dict of the current data, to be restored with
+        restore_state after a restart
+        '''
+        if not self._temp_humi_ts:
+            return {}
+        return {"timestamp": self._temp_humi_ts.strftime(STATE_TS_FORMAT),
+                "temperature": self._temp, "humidity": self._humi}
+
+    def restore_state(self, state):
+        '''
+        Restore a state saved by save_state, data older than the max data
+        age is dropped as usual. Raises ValueError, KeyError or TypeError on
+        an invalid state, leaving the current state as is
+        '''
+        if not isinstance(state, dict):
+            raise ValueError("Invalid RHT sensor state")
+        if not state.get("timestamp"):
+            return
+        timestamp = datetime.strptime(state["timestamp"], STATE_TS_FORMAT)
+        values = (state["temperature"], state["humidity"])
+        if not all(value is None or (isinstance(value, (int, float)) and
+                                     not isinstance(value, bool))
+                   for value in values):
+            raise ValueError("Invalid RHT sensor state")
+        self._temp_humi_ts = timestamp
+        self._temp, self._humi = values
+        self._check_max_data_age()
@@ -0,0 +1,150 @@
+#!/usr/bin/env python
+# encoding: utf-8
+'''
+replay -- Compare thermostat modes by replaying recorded RHT data
+
+Replays a CSV file with recorded sensor readings, one reading per line as
+"timestamp,temperature,humidity" with an ISO 8601 timestamp, through the
+hysteresis and dwell thermostats configured as in the given zone. Readings
+are held like RHTSensor does and the thermostats are updated once a minute,
+as the control loop would.
+
+The replay is open loop, the recorded data is not affected by the replayed
+heater output. Reported per mode are relay toggles (each costing a
+confirmed downlink) per zone-day, heater on time, and discomfort: minutes
+out of the setpoints with the heater off.
+
+@author:     Daniel Nilsson
+
+@copyright:  2020 DNIL Electronics AB. All rights reserved.
+
+@license:    Apache License 2.0
+
+@contact:    daniel@dnil.se
+'''
+
+import sys
+import os
+import csv
+import copy
+import logging
+import argparse
+from datetime import datetime, timedelta
+import config
+import thermostat
+
+# Same max data age as RHTSensor
+READING_MAX_AGE = timedelta(minutes=65)
+STEP = timedelta(minutes=1)
+
+
+def read_csv(path):
+    ''' Returns a list of (timestamp, temperature, humidity) sorted by time '''
+    readings = []
+    with open(path) as csv_file:
+        for row in csv.reader(csv_file):
+            if not row or row[0].startswith("#"):
+                continue
+            try:
+                timestamp = datetime.strptime(row[0].strip().replace("T", " ")[:19],
+                                              "%Y-%m-%d %H:%M:%S")
+                readings.append((timestamp, float(row[1]), float(row[2])))
+            except (ValueError, IndexError):
+                # Header or malformed line
+                continue
+    readings.sort()
+    return readings
+
+
+def replay(readings, thermo_cfg):
+    ''' Replay readings through a thermostat, returns a dict of metrics '''
+    thermo = thermostat.configure_thermostat(thermostat.RHTThermostat(),
+                                             thermo_cfg)
+    dwell = isinstance(thermo, thermostat.DwellThermostat)
+    toggles = 0
+    on_minutes = 0
+    discomfort_minutes = 0
+
+    index = 0
+    now = readings[0][0]
+    current = None
+    while now <= readings[-1][0]:
+        while index < len(readings) and readings[index][0] <= now:
+            current = readings[index]
+            index += 1
+
+        if current and current[0] + READING_MAX_AGE >= now:
+            temperature, humidity = current[1], current[2]
+        else:
+            temperature, humidity = None, None
+
+        output = thermo.output()
+        reading_time = current[0] if current else None
+        if dwell:
+            thermo.update_actual_values(humidity, temperature, reading_time, now)
+        else:
+            thermo.update_actual_values(humidity, temperature, reading_time)
+        if thermo.output() != output:
+            toggles += 1
+
+        if thermo.output():
+            on_minutes += 1
+        elif temperature is not None and \
+        (temperature < thermo_cfg["min_temp"] or humidity > thermo_cfg["max_rh"]):
+            discomfort_minutes += 1
+
+        now += STEP
+
+    days = max((readings[-1][0] - readings[0][0]).total_seconds() / 86400.0,
+               1.0 / 24)
+    return {"toggles": toggles, "toggles_per_day": toggles / days,
+            "on_hours": on_minutes / 60.0,
+            "discomfort_minutes": discomfort_minutes}
+
+
+def main():
+    '''Replay application'''
+
+    program_name = os.path.basename(sys.argv[0])
+    default_config = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                  "heaterctrl.json")
+
+    parser = argparse.ArgumentParser(description="Replay recorded RHT data "
+                                     "through the thermostat modes")
+    parser.add_argument("data", help="CSV file, timestamp,temperature,humidity")
+    parser.add_argument("-c", "--config", default=default_config,
+                        help="deployment config file (default: %(default)s)")
+    parser.add_argument("-z", "--zone", default=None,
+                        help="zone to take thermostat config from "
+                        "(default: first zone)")
+    args = parser.parse_args()
+
+    # Thermostat output changes are counted, not logged
+    logging.getLogger(thermostat.__name__).setLevel(logging.WARNING)
+
+    try:
+        cfg = config.load(args.config)
+        zone = args.zone or sorted(cfg["zones"])[0]
+        readings = read_csv(args.data)
+        if not readings:
+            raise RuntimeError("No readings in " + args.data)
+
+        sys.stdout.write("%-12s %8s %10s %9s %14s\n" %
+                         ("mode", "toggles", "per day", "on hours",
+                          "discomf. min"))
+        for mode in thermostat.THERMOSTAT_MODES:
+            thermo_cfg = copy.deepcopy(cfg["zones"][zone]["thermostat"])
+            thermo_cfg["mode"] = mode
+            result = replay(readings, thermo_cfg)
+            sys.stdout.write("%-12s %8d %10.1f %9.1f %14d\n" %
+                             (mode, result["toggles"], result["toggles_per_day"],
+                              result["on_hours"], result["discomfort_minutes"]))
+
+    except (IOError, ValueError, KeyError, RuntimeError) as exception:
+        sys.stderr.write(program_name + ": " + repr(exception) + "\n")
+        return -1
+
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
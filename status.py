@@ -0,0 +1,101 @@
+'''
+Created on Oct 18, 2026
+
+@author: daniel
+
+Read-only HTTP/JSON status endpoint. The control loop publishes a status
+dict after each change, it is serialized once and the immutable result is
+swapped in as a single reference assignment. Request threads only read that
+reference, so any number of readers never take a lock shared with, or do
+work on behalf of, uplink processing.
+'''
+
+import json
+import logging
+import threading
+from datetime import datetime
+
+try:
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+    from socketserver import ThreadingMixIn
+except ImportError:
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+    from SocketServer import ThreadingMixIn
+
+LOGGER = logging.getLogger(__name__)
+
+
+class _StatusRequestHandler(BaseHTTPRequestHandler):
+    ''' Serves the current snapshot on GET / and /status '''
+
+    def do_GET(self):
+        ''' Handle GET requests '''
+        # Single read of the published reference, never modified afterwards
+        body = self.server.snapshot
+        if self.path.split("?")[0] not in ("/", "/status"):
+            self.send_error(404)
+            return
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.send_header("Cache-Control", "no-cache")
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, fmt, *args):
+        LOGGER.debug("%s " + fmt, self.address_string(), *args)
+
+
+class _ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+class StatusServer(object):
+    '''
+    HTTP server publishing status snapshots from the control loop
+    '''
+
+    def __init__(self, host, port):
+        '''
+        Constructor, the server is started with start()
+        '''
+        self._host = host
+        self._port = port
+        self._server = None
+        self._last_status = None
+        self._snapshot = b"{}"
+
+    def publish(self, status):
+        '''
+        Publish a status dict, call from the control loop only. Nothing is
+        done unless it differs from the last one, a new snapshot gets the
+        time of the change added. The dict must not be modified afterwards
+        '''
+        if status == self._last_status:
+            return
+        self._last_status = status
+        snapshot = json.dumps(dict(status, time=datetime.now().isoformat()),
+                              sort_keys=True).encode('utf-8')
+        self._snapshot = snapshot
+        if self._server:
+            # Copy-on-write swap, readers keep the snapshot they picked up
+            self._server.snapshot = snapshot
+
+    def start(self):
+        ''' Start serving requests in a daemon thread '''
+        self._server = _ThreadingHTTPServer((self._host, self._port),
+                                            _StatusRequestHandler)
+        self._server.snapshot = self._snapshot
+        thread = threading.Thread(target=self._server.serve_forever,
+                                  name="status-server")
+        thread.daemon = True
+        thread.start()
+        LOGGER.info("Status API on http://%s:%d/status", self._host,
+                    self._server.server_address[1])
+
+    def stop(self):
+        ''' Stop serving requests '''
+        if self._server:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
@@ -0,0 +1,119 @@
+'''
+Created on Oct 19, 2026
+
+@author: daniel
+
+Unit tests for the payload codec against the byte layouts the LR210 and
+OY1110 decoders used before it, run with python -m pytest or unittest
+'''
+
+import unittest
+import codec
+
+
+class LR210CodecTest(unittest.TestCase):
+    ''' Tests of LR210 uplinks and downlinks '''
+
+    def test_periodic(self):
+        ''' Relay state word followed by temperature, 0.1 degrees 80 offset '''
+        self.assertEqual(
+            codec.decode(codec.LR210, codec.PERIODIC_PORT,
+                         bytearray([0x00, 0x02, 0x03, 0xe8])),
+            ("periodic", {"relay": 2, "temperature": 20.0}))
+        self.assertEqual(
+            codec.decode(codec.LR210, codec.PERIODIC_PORT,
+                         bytearray([0x00, 0x03, 0x02, 0xd0])),
+            ("periodic", {"relay": 3, "temperature": -8.0}))
+
+    def test_periodic_length(self):
+        ''' Periodic data must be exactly 4 bytes '''
+        for data in (bytearray(3), bytearray(5)):
+            self.assertIsNone(codec.decode(codec.LR210, codec.PERIODIC_PORT,
+                                           data))
+
+    def test_relay_state(self):
+        ''' Relay state response, trailing bytes are ignored '''
+        self.assertEqual(
+            codec.decode(codec.LR210, codec.PROTOCOL_PORT,
+                         bytearray([0x01, 0x22, 0x00, 0x01])),
+            ("relay_state", {"relay": 1}))
+        self.assertEqual(
+            codec.decode(codec.LR210, codec.PROTOCOL_PORT,
+                         bytearray([0x01, 0x22, 0x00, 0x02, 0xff])),
+            ("relay_state", {"relay": 2}))
+
+    def test_short_relay_state(self):
+        ''' Relay state responses without the full state word are dropped '''
+        for data in (bytearray([0x01]), bytearray([0x01, 0x22]),
+                     bytearray([0x01, 0x22, 0x00])):
+            self.assertIsNone(codec.decode(codec.LR210, codec.PROTOCOL_PORT,
+                                           data))
+
+    def test_unknown_response(self):
+        ''' Unknown protocol responses are passed on with their raw data '''
+        self.assertEqual(
+            codec.decode(codec.LR210, codec.PROTOCOL_PORT,
+                         bytearray([0x01, 0x10, 0xab])),
+            ("response", {"command": 0x01, "index": 0x10, "data": b"\xab"}))
+
+    def test_unknown_port(self):
+        ''' Data on other ports is not decoded '''
+        self.assertIsNone(codec.decode(codec.LR210, 3, bytearray(4)))
+
+    def test_set_frame(self):
+        ''' Set command, header and big endian mask and state '''
+        self.assertEqual(
+            codec.encode(codec.LR210, codec.PROTOCOL_PORT, codec.CMD_SET,
+                         codec.IDX_RELAY_STATE, 0x00020002),
+            bytearray([0x01, 0x22, 0x00, 0x02, 0x00, 0x02]))
+
+    def test_set_frame_reused_buffer(self):
+        ''' A reused buffer is fully overwritten '''
+        buf = codec.new_buffer(codec.LR210, codec.PROTOCOL_PORT, codec.CMD_SET,
+                               codec.IDX_RELAY_STATE)
+        codec.pack_into(buf, codec.LR210, codec.PROTOCOL_PORT, codec.CMD_SET,
+                        codec.IDX_RELAY_STATE, 0x00030003)
+        codec.pack_into(buf, codec.LR210, codec.PROTOCOL_PORT, codec.CMD_SET,
+                        codec.IDX_RELAY_STATE, 0x00010000)
+        self.assertEqual(buf, bytearray([0x01, 0x22, 0x00, 0x01, 0x00, 0x00]))
+
+    def test_query_frame(self):
+        ''' Relay state query, header only '''
+        self.assertEqual(
+            codec.encode(codec.LR210, codec.PROTOCOL_PORT, codec.CMD_QUERY,
+                         codec.IDX_RELAY_STATE),
+            bytearray([0x02, 0x22]))
+
+    def test_unknown_downlink(self):
+        ''' Downlinks not in the registry raise '''
+        self.assertRaises(RuntimeError, codec.encode, codec.LR210,
+                          codec.PROTOCOL_PORT, codec.CMD_QUERY, 0x10)
+
+
+class OY1110CodecTest(unittest.TestCase):
+    ''' Tests of OY1110 uplinks '''
+
+    def test_periodic(self):
+        ''' 12-bit temperature and humidity, low nibbles in the third byte '''
+        self.assertEqual(
+            codec.decode(codec.OY1110, codec.PERIODIC_PORT,
+                         bytearray([0x3e, 0x2e, 0x8e])),
+            ("periodic", {"temperature": 20.0, "humidity": 50.0}))
+        self.assertEqual(
+            codec.decode(codec.OY1110, codec.PERIODIC_PORT,
+                         bytearray([0x2e, 0x2d, 0xe0])),
+            ("periodic", {"temperature": -5.0, "humidity": 47.0}))
+
+    def test_periodic_length(self):
+        ''' Only ungrouped data of exactly 3 bytes is decoded '''
+        for data in (bytearray(2), bytearray(6)):
+            self.assertIsNone(codec.decode(codec.OY1110, codec.PERIODIC_PORT,
+                                           data))
+
+    def test_unknown_port(self):
+        ''' Data on other ports is not decoded '''
+        self.assertIsNone(codec.decode(codec.OY1110, 5, bytearray(3)))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,139 @@
+'''
+Created on Oct 19, 2026
+
+@author: daniel
+
+Unit tests for deployment config validation, run with python -m pytest or
+unittest
+'''
+
+import os
+import copy
+import json
+import shutil
+import tempfile
+import unittest
+import config
+
+ZONE = {"rht_sensor": {"application": "application/6", "dev_eui": "s1"},
+        "lr210": {"application": "application/20", "dev_eui": "r1",
+                  "channel": 1}}
+
+
+def with_zone(**zone_keys):
+    ''' Returns a config dict of ZONE updated with zone_keys '''
+    zone = copy.deepcopy(ZONE)
+    zone.update(zone_keys)
+    return {"zones": {"garage": zone}}
+
+
+class ValidateTest(unittest.TestCase):
+    ''' Tests of config.validate '''
+
+    def assertInvalid(self, cfg):
+        ''' Assert cfg is rejected '''
+        self.assertRaises(RuntimeError, config.validate, cfg)
+
+    def test_defaults(self):
+        ''' Missing sections and thermostat keys get their defaults '''
+        cfg = config.validate(with_zone(thermostat={"min_temp": -15}))
+        self.assertEqual(cfg["retry"], config.DEFAULT_CONFIG["retry"])
+        self.assertEqual(cfg["zones"]["garage"]["thermostat"]["min_temp"], -15)
+        self.assertEqual(cfg["zones"]["garage"]["thermostat"]["mode"],
+                         "hysteresis")
+
+    def test_not_modified(self):
+        ''' The given dict is left as is '''
+        cfg = with_zone()
+        config.validate(cfg)
+        self.assertEqual(cfg, with_zone())
+
+    def test_unknown_keys(self):
+        ''' Unknown keys are rejected on every level '''
+        self.assertInvalid(dict(with_zone(), retries={}))
+        self.assertInvalid(dict(with_zone(), mqtt={"hostname": "x"}))
+        self.assertInvalid(with_zone(heater={}))
+        self.assertInvalid(with_zone(thermostat={"max_temp": 5.0}))
+
+    def test_wrong_types(self):
+        ''' Keys with other types than their defaults are rejected '''
+        for cfg in (dict(with_zone(), mqtt={"port": "1883"}),
+                    dict(with_zone(), mqtt={"port": True}),
+                    dict(with_zone(), mqtt={"tls": 1}),
+                    dict(with_zone(), retry={"max_retries": 2.5}),
+                    dict(with_zone(), status=[]),
+                    dict(with_zone(), state_file=None),
+                    {"zones": []},
+                    with_zone(thermostat={"min_temp": "5"}),
+                    with_zone(thermostat=[])):
+            self.assertInvalid(cfg)
+
+    def test_ranges(self):
+        ''' Numeric keys out of range are rejected '''
+        for cfg in (dict(with_zone(), status={"port": 65536}),
+                    dict(with_zone(), retry={"period_minutes": 0}),
+                    dict(with_zone(), retry={"max_retries": -1}),
+                    with_zone(thermostat={"temp_hysteresis": -1.0}),
+                    with_zone(thermostat={"dwell_max_toggles_per_hour": 0})):
+            self.assertInvalid(cfg)
+
+    def test_devices(self):
+        ''' Device objects need exactly their fields '''
+        self.assertInvalid(with_zone(rht_sensor={"dev_eui": "s1"}))
+        self.assertInvalid(with_zone(rht_sensor={"application": "a",
+                                                 "dev_eui": 1}))
+        self.assertInvalid(with_zone(lr210={"application": "a",
+                                            "dev_eui": "r1", "channel": 3}))
+        self.assertInvalid(with_zone(lr210={"application": "a",
+                                            "dev_eui": "r1", "channel": True}))
+
+    def test_multicast_group(self):
+        ''' Multicast groups need a list of dev_eui strings '''
+        group = {"application": "application/20", "group_id": "g1",
+                 "dev_euis": ["m1", "m2"]}
+        config.validate(with_zone(multicast_group=group))
+        for dev_euis in ("m1", ["m1", 2], None):
+            self.assertInvalid(with_zone(multicast_group=dict(group,
+                                                              dev_euis=dev_euis)))
+
+    def test_thermostat_mode(self):
+        ''' Only known thermostat modes are accepted '''
+        config.validate(with_zone(thermostat={"mode": "dwell"}))
+        self.assertInvalid(with_zone(thermostat={"mode": "pid"}))
+
+    def test_no_zones(self):
+        ''' At least one zone is needed '''
+        self.assertInvalid({})
+
+    def test_device_types(self):
+        ''' A device can not be both RHT sensor and LR210 '''
+        self.assertInvalid(with_zone(rht_sensor={"application": "application/20",
+                                                 "dev_eui": "r1"}))
+
+
+class LoadTest(unittest.TestCase):
+    ''' Tests of config.load '''
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmp_dir, "heaterctrl.json")
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_state_file_path(self):
+        ''' A relative state file is relative to the config file '''
+        with open(self.path, "w") as cfg_file:
+            json.dump(dict(with_zone(), state_file="state.json"), cfg_file)
+        self.assertEqual(config.load(self.path)["state_file"],
+                         os.path.join(self.tmp_dir, "state.json"))
+
+    def test_invalid_json(self):
+        ''' Syntax errors raise ValueError '''
+        with open(self.path, "w") as cfg_file:
+            cfg_file.write("{")
+        self.assertRaises(ValueError, config.load, self.path)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,236 @@
+'''
+Created on Oct 19, 2026
+
+@author: daniel
+
+Unit tests for applying and reloading the deployment config, using a stub
+LoRa Server interface. Run with python -m pytest or unittest
+'''
+
+import os
+import json
+import shutil
+import tempfile
+import functools
+import unittest
+from datetime import datetime
+import config
+import controller
+
+RHT_APP = "application/6"
+LR210_APP = "application/20"
+
+SET_ON_CH1 = b"\x01\x22\x00\x01\x00\x01"
+SET_OFF_CH1 = b"\x01\x22\x00\x01\x00\x00"
+QUERY = b"\x02\x22"
+
+
+class StubLoraIf(object):
+    ''' Records subscriptions and downlinks instead of using MQTT '''
+
+    def __init__(self):
+        self.devices = {}
+        self.downlinks = []
+        self.multicasts = []
+
+    def add_device(self, lora_app, callback):
+        self.devices[lora_app] = callback
+        return functools.partial(self._downlink, lora_app)
+
+    def _downlink(self, lora_app, data):
+        self.downlinks.append((lora_app, bytes(data[0])))
+
+    def remove_device(self, lora_app):
+        del self.devices[lora_app]
+
+    def multicast_dl_handler(self, group_id, data):
+        self.multicasts.append((group_id, bytes(data[0])))
+        return True
+
+    def set_multicast_api(self, api_url, api_token):
+        pass
+
+    def sent_to(self, dev_eui):
+        ''' Returns the downlinks sent to dev_eui '''
+        return [data for lora_app, data in self.downlinks
+                if lora_app[1] == dev_eui]
+
+
+def zone(sensor, relay, channel=1, **zone_keys):
+    ''' Returns a zone config dict '''
+    zone_cfg = {"rht_sensor": {"application": RHT_APP, "dev_eui": sensor},
+                "lr210": {"application": LR210_APP, "dev_eui": relay,
+                          "channel": channel}}
+    zone_cfg.update(zone_keys)
+    return zone_cfg
+
+
+def group(*dev_euis):
+    ''' Returns a multicast group config dict '''
+    return {"application": LR210_APP, "group_id": "g1",
+            "dev_euis": list(dev_euis)}
+
+
+class ControllerTestCase(unittest.TestCase):
+    ''' Controller with a stub LoRa Server interface and a config file '''
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmp_dir, "heaterctrl.json")
+        self.lora_if = StubLoraIf()
+        self.ctrl = controller.ClimateController()
+        self.ctrl._lora_if = self.lora_if
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def load(self, zones, **cfg_keys):
+        ''' Write a config file with zones and load or reload it '''
+        with open(self.path, "w") as cfg_file:
+            cfg_file.write(zones if isinstance(zones, str) else
+                           json.dumps(dict(cfg_keys, zones=zones)))
+        if self.ctrl._applied is None:
+            self.ctrl.load_config(self.path)
+            self.ctrl._apply_config(config.validate(self.ctrl._config))
+        else:
+            self.ctrl.reload()
+
+    def device(self, dev_eui):
+        ''' Returns the registered device object of dev_eui '''
+        return dict((key[1], device)
+                    for key, device in self.ctrl._devices.items())[dev_eui]
+
+    def uplink(self, dev_eui, data, port=2):
+        ''' Feed an uplink to the subscribed callback of dev_eui '''
+        app = RHT_APP if dev_eui.startswith("s") else LR210_APP
+        self.lora_if.devices[(app, dev_eui)]((bytearray(data), port))
+
+
+class ApplyConfigTest(ControllerTestCase):
+    ''' Tests of applying and reloading the config '''
+
+    def test_subscriptions(self):
+        ''' Devices are subscribed and unsubscribed with their zones '''
+        self.load({"a": zone("s1", "r1", multicast_group=group("m1", "m2"))})
+        self.assertEqual(sorted(key[1] for key in self.lora_if.devices),
+                         ["m1", "m2", "r1", "s1"])
+        self.load({"a": zone("s1", "r1", multicast_group=group("m2", "m3")),
+                   "b": zone("s2", "r1", 2)})
+        self.assertEqual(sorted(key[1] for key in self.lora_if.devices),
+                         ["m2", "m3", "r1", "s1", "s2"])
+
+    def test_device_kept(self):
+        ''' Devices and thermostats are kept over a thermostat change '''
+        self.load({"a": zone("s1", "r1")})
+        relay = self.device("r1")
+        thermo = self.ctrl._zones["a"].thermostat()
+        self.load({"a": zone("s1", "r1", thermostat={"min_temp": 2.0})})
+        self.assertIs(self.device("r1"), relay)
+        self.assertIs(self.ctrl._zones["a"].thermostat(), thermo)
+        self.assertEqual(thermo.status()["min_temp"], 2.0)
+
+    def test_mode_change(self):
+        ''' A mode change replaces the thermostat keeping its output '''
+        self.load({"a": zone("s1", "r1")})
+        self.ctrl._zones["a"].thermostat().restore_output(True)
+        self.load({"a": zone("s1", "r1", thermostat={"mode": "dwell"})})
+        thermo = self.ctrl._zones["a"].thermostat()
+        self.assertEqual(type(thermo).__name__, "DwellThermostat")
+        self.assertTrue(thermo.output())
+
+    def test_invalid_reload(self):
+        ''' An invalid file keeps the current config and devices '''
+        self.load({"a": zone("s1", "r1")})
+        applied = self.ctrl._applied
+        for invalid in ("{", json.dumps({"zones": {"a": zone("s1", "r1", 3)}}),
+                        json.dumps({"zones": {"a": zone("s2", "r2", heater={})}}),
+                        json.dumps({"zones": {"a": zone("s1", "r1", rht_sensor={
+                            "application": LR210_APP, "dev_eui": "r1"})}})):
+            self.load(invalid)
+            self.assertIs(self.ctrl._applied, applied)
+            self.assertEqual(sorted(key[1] for key in self.lora_if.devices),
+                             ["r1", "s1"])
+
+    def test_removed_device_switched_off(self):
+        ''' Removed LR210s get an explicit off even with a command in flight '''
+        self.load({"a": zone("s1", "r1", multicast_group=group("m1"))})
+        self.uplink("r1", b"\x00\x00\x03\xe8")
+        self.device("r1").set_channel_state([(1, True)])
+        self.load({"b": zone("s2", "r2")})
+        self.assertEqual(self.lora_if.sent_to("r1")[-1], SET_OFF_CH1)
+        self.assertEqual(self.lora_if.sent_to("m1"), [SET_OFF_CH1])
+        self.assertNotIn((LR210_APP, "r1"), self.lora_if.devices)
+
+    def test_kept_device_switched_off(self):
+        ''' A channel losing its zone is switched off on a kept LR210 '''
+        self.load({"a": zone("s1", "r1"), "b": zone("s2", "r1", 2)})
+        self.uplink("r1", b"\x00\x02\x03\xe8")
+        self.load({"a": zone("s1", "r1")})
+        self.assertEqual(self.lora_if.sent_to("r1"),
+                         [b"\x01\x22\x00\x02\x00\x00"])
+
+    def test_connect_query_once(self):
+        ''' A LR210 shared by zones is queried once on connect '''
+        self.load({"a": zone("s1", "r1"), "b": zone("s2", "r1", 2)})
+        self.ctrl.mqtt_connect_handler()
+        self.assertEqual(self.lora_if.sent_to("r1"), [QUERY])
+
+
+
+class StateFileTest(ControllerTestCase):
+    ''' Tests of restoring saved state at startup '''
+
+    def save(self, state):
+        ''' Write state to the state file '''
+        with open(os.path.join(self.tmp_dir, "state.json"), "w") as state_file:
+            json.dump(state, state_file)
+
+    def test_restored_state(self):
+        ''' Restored states are used at once and still verified '''
+        now = datetime.now().strftime("%Y-%m-%dT%H:%M:%S.%f")
+        self.save({"devices": [
+            {"application": RHT_APP, "dev_eui": "s1",
+             "state": {"timestamp": now, "temperature": 5.0, "humidity": 95.0}},
+            {"application": LR210_APP, "dev_eui": "r1",
+             "state": {"timestamp": now, "temperature": 20.0,
+                       "channels": {"1": "deactive", "2": "deactive"}}}],
+                   "thermostats": {"a": False}})
+        self.load({"a": zone("s1", "r1")}, state_file="state.json")
+        self.ctrl._load_state()
+        self.ctrl.mqtt_connect_handler()
+        self.ctrl._zones["a"].control()
+        self.assertEqual(self.lora_if.sent_to("r1"), [QUERY, SET_ON_CH1])
+
+    def test_invalid_entries(self):
+        ''' Invalid entries are skipped without half restoring a device '''
+        now = datetime.now().strftime("%Y-%m-%dT%H:%M:%S.%f")
+        self.save({"devices": [
+            {"application": RHT_APP, "dev_eui": "s1", "state": None},
+            {"application": LR210_APP, "dev_eui": "r1",
+             "state": {"timestamp": now, "temperature": 20.0, "channels": []}},
+            {"application": LR210_APP, "dev_eui": ["r2"], "state": {}},
+            "r2",
+            {"application": LR210_APP, "dev_eui": "r2",
+             "state": {"timestamp": now, "temperature": 20.0,
+                       "channels": {"1": "active"}}}],
+                   "thermostats": {"a": "on", "b": True}})
+        self.load({"a": zone("s1", "r1"), "b": zone("s2", "r2")},
+                  state_file="state.json")
+        self.ctrl._load_state()
+        self.assertIsNone(self.device("r1").status()["data_time"])
+        self.assertIsNone(self.device("r1").temperature())
+        self.assertEqual(self.device("r2").temperature(), 20.0)
+        self.assertFalse(self.ctrl._zones["a"].thermostat().output())
+        self.assertTrue(self.ctrl._zones["b"].thermostat().output())
+
+    def test_invalid_file(self):
+        ''' Files of the wrong shape are ignored '''
+        self.load({"a": zone("s1", "r1")}, state_file="state.json")
+        for state in ([], {"devices": {}, "thermostats": {}},
+                      {"devices": [], "thermostats": []}, {"devices": []}):
+            self.save(state)
+            self.ctrl._load_state()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,78 @@
+'''
+Created on Oct 19, 2026
+
+@author: daniel
+
+Unit tests for the LR210 relay controller and multicast groups, run with
+python -m pytest or unittest
+'''
+
+import struct
+import unittest
+from datetime import timedelta
+import lr210
+
+
+def periodic(relay):
+    ''' Returns a periodic uplink with relay states and 20 degrees '''
+    return (bytearray(struct.pack(">HH", relay, 1000)), 2)
+
+
+def sent_cmds(downlinks):
+    ''' Returns the relay set commands (integers) of a list of downlinks '''
+    return [struct.unpack(">I", data[2:])[0] for data, _port in downlinks
+            if len(data) == 6]
+
+
+class LR210GroupTest(unittest.TestCase):
+    '''
+    Tests of an LR210 that is both a zone main LR210 on channel 1 and a
+    multicast group member on channel 2
+    '''
+
+    def setUp(self):
+        self.unicast = dict((name, []) for name in ("main", "other"))
+        self.multicast = []
+        self.main = lr210.LR210()
+        self.other = lr210.LR210()
+        for name, device in (("main", self.main), ("other", self.other)):
+            # Copied, the set command buffer is reused
+            device.set_dl_handler(lambda data, sent=self.unicast[name]:
+                                  sent.append((bytes(data[0]), data[1])))
+            device.uplink_data_handler(periodic(0))
+        self.group = lr210.LR210Group([self.main, self.other],
+                                      timedelta(minutes=70))
+        self.group.set_dl_handler(lambda data: self.multicast.append(data) or True)
+
+    def test_unicast_pending_kept(self):
+        ''' A multicast does not replace a pending unicast command '''
+        self.main.set_channel_state([(1, True)])
+        self.group.set_channel_state([(2, True)])
+        self.assertEqual(sent_cmds(self.multicast), [0x00020002])
+        # Both channels by unicast, retried as one command
+        self.assertEqual(sent_cmds(self.unicast["main"]),
+                         [0x00010001, 0x00030003])
+        self.assertEqual(self.main.status()["pending_command"]["cmd"],
+                         "0x00030003")
+        self.assertEqual(sent_cmds(self.unicast["other"]), [])
+
+    def test_other_channel_during_multicast(self):
+        ''' A change on another channel is not held back by a multicast '''
+        self.group.set_channel_state([(2, True)])
+        self.assertEqual(sent_cmds(self.unicast["main"]), [])
+        self.main.set_channel_state([(1, True)])
+        self.assertEqual(sent_cmds(self.unicast["main"]), [0x00030003])
+        self.assertFalse(self.main.status()["pending_command"]["multicast"])
+
+    def test_multicast_channel_held(self):
+        ''' No unicast for the multicast channel until verified '''
+        self.group.set_channel_state([(2, True)])
+        self.group.set_channel_state([(2, True)])
+        self.main.periodic_poll()
+        self.assertEqual(sent_cmds(self.unicast["main"]), [])
+        self.main.uplink_data_handler(periodic(2))
+        self.assertIsNone(self.main.status()["pending_command"])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,110 @@
+'''
+Created on Oct 19, 2026
+
+@author: daniel
+
+Unit tests for the thermostats, run with python -m pytest or unittest
+'''
+
+import unittest
+from datetime import datetime, timedelta
+import thermostat
+
+START = datetime(2026, 1, 1)
+
+
+def minutes(count):
+    ''' Returns START plus count minutes '''
+    return START + timedelta(minutes=count)
+
+
+class RHTThermostatTest(unittest.TestCase):
+    ''' Tests of RHTThermostat '''
+
+    def test_zero_reading(self):
+        ''' Readings of 0.0 degrees or 0.0 %RH are valid '''
+        thermo = thermostat.RHTThermostat(-15.0, 80.0)
+        thermo.update_actual_values(95.0, 0.0)
+        self.assertTrue(thermo.output_active())
+        self.assertTrue(thermo.output())
+        thermo = thermostat.RHTThermostat(5.0, 80.0)
+        thermo.update_actual_values(0.0, 0.0)
+        self.assertTrue(thermo.output_active())
+        self.assertTrue(thermo.output())
+
+
+class DwellThermostatTest(unittest.TestCase):
+    ''' Tests of DwellThermostat '''
+
+    def setUp(self):
+        self.thermo = thermostat.DwellThermostat(-15.0, 80.0)
+
+    def test_held_reading(self):
+        ''' A reading held for longer than the trend window keeps working '''
+        for minute in range(300):
+            self.thermo.update_actual_values(70.0, 5.0, minutes(0),
+                                             minutes(minute))
+        self.assertTrue(self.thermo.output_active())
+        self.assertFalse(self.thermo.output())
+        self.thermo.update_actual_values(90.0, 5.0, minutes(300),
+                                         minutes(300))
+        self.assertTrue(self.thermo.output())
+
+    def test_short_trend_window(self):
+        ''' Readings older than the trend window are not used for prediction '''
+        readings = ((0, 70.0), (5, 71.0), (40, 79.0))
+        for minute, humidity in readings:
+            self.thermo.update_actual_values(humidity, 5.0, minutes(minute),
+                                             minutes(minute))
+        # The rising trend predicts a crossing with the default window
+        self.assertTrue(self.thermo.output())
+
+        self.thermo = thermostat.DwellThermostat(-15.0, 80.0)
+        self.thermo.set_prediction(timedelta(minutes=30), timedelta(minutes=60))
+        for minute, humidity in readings:
+            self.thermo.update_actual_values(humidity, 5.0, minutes(minute),
+                                             minutes(minute))
+        self.assertFalse(self.thermo.output())
+
+    def test_uplinks_with_same_values(self):
+        ''' Separate uplinks are separate readings even with same values '''
+        for minute, humidity in ((0, 77.0), (10, 80.0)):
+            self.thermo.update_actual_values(humidity, 5.0, minutes(minute),
+                                             minutes(minute))
+            # Repeated by the control loop until the next uplink
+            self.thermo.update_actual_values(humidity, 5.0, minutes(minute),
+                                             minutes(minute + 1))
+        # Too few readings for a trend
+        self.assertFalse(self.thermo.output())
+        # A third reading, the trend predicts a crossing
+        self.thermo.update_actual_values(80.0, 5.0, minutes(20), minutes(20))
+        self.assertTrue(self.thermo.output())
+
+    def test_predicted_switch_on(self):
+        ''' Rising RH inside the band switches on before crossing it '''
+        for minute, humidity in ((0, 77.0), (10, 78.0), (20, 79.0), (30, 80.0)):
+            self.thermo.update_actual_values(humidity, 5.0, minutes(minute),
+                                             minutes(minute))
+        self.assertTrue(self.thermo.output())
+
+    def test_zero_reading(self):
+        ''' Readings of 0.0 degrees or 0.0 %RH are valid '''
+        self.thermo.update_actual_values(95.0, 0.0, minutes(0), minutes(0))
+        self.assertTrue(self.thermo.output_active())
+        self.assertTrue(self.thermo.output())
+        self.thermo.update_actual_values(0.0, 20.0, minutes(30), minutes(30))
+        self.assertTrue(self.thermo.output_active())
+        self.assertFalse(self.thermo.output())
+
+    def test_min_dwell(self):
+        ''' Output is held for the minimum on time '''
+        self.thermo.update_actual_values(90.0, 5.0, minutes(0), minutes(0))
+        self.assertTrue(self.thermo.output())
+        self.thermo.update_actual_values(70.0, 5.0, minutes(10), minutes(10))
+        self.assertTrue(self.thermo.output())
+        self.thermo.update_actual_values(70.0, 5.0, minutes(10), minutes(21))
+        self.assertFalse(self.thermo.output())
+
+
+if __name__ == "__main__":
+    unittest.main()
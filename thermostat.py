@@ -0,0 +1,276 @@
+'''
+Created on Feb 21, 2020
+
+@author: daniel
+
+Thermostats and their configuration modes
+'''
+
+import logging
+import collections
+from datetime import datetime, timedelta
+
+LOGGER = logging.getLogger(__name__)
+
+class RHTThermostat(object):
+    '''
+    Implements a thermostat based on both RH and temp data
+    '''
+
+    def __init__(self, min_temp=-5.0, max_rh=80.0):
+        '''
+        Constructor
+        '''
+        self._min_temp = min_temp
+        self._temp_hyst = 3.0
+        self._max_rh = max_rh
+        self._rh_hyst = 5.0
+        self._actuals_valid = False
+        self._output_state = False
+
+    def set_limits(self, min_temp, max_rh):
+        '''
+        Override the temperature and RH setpoints, output state is kept
+        '''
+        self._min_temp = min_temp
+        self._max_rh = max_rh
+
+    def set_rh_hysteresis(self, rh_hyst):
+        '''
+        Override default RH hysteresis, value in percent
+        '''
+        self._rh_hyst = rh_hyst
+
+    def set_temp_hysteresis(self, temp_hyst):
+        '''
+        Override default temperature hysteresis, value in percent
+        '''
+        self._temp_hyst = temp_hyst
+
+    def restore_output(self, output_state):
+        '''
+        Restore the output state, used when a zone thermostat is replaced
+        '''
+        self._output_state = output_state
+
+    def _band_check(self, humidity, temperature, heating):
+        '''
+        Returns a tuple of temperature OK and humidity OK for the actual
+        values, using the hysteresis band edge matching the heating state
+        '''
+        if heating:
+            # We are heating, check criteria
+            temp_ok = temperature > self._min_temp + (self._temp_hyst / 2)
+            hum_ok = humidity < self._max_rh - (self._rh_hyst / 2)
+        else:
+            # We are not heating
+            temp_ok = temperature > self._min_temp - (self._temp_hyst / 2)
+            hum_ok = humidity < self._max_rh + (self._rh_hyst / 2)
+        return (temp_ok, hum_ok)
+
+    def _set_output(self, new_output_state, temp_ok, hum_ok):
+        if new_output_state != self._output_state:
+            LOGGER.info("Heather change from " + str(self._output_state) +
+                        " to " + str(new_output_state) +
+                        " temperature OK: " + str(temp_ok) +
+                        " humidity OK: " + str(hum_ok))
+            self._output_state = new_output_state
+
+    def update_actual_values(self, humidity, temperature, reading_time=None):
+        '''
+        Update actual values and performs output calculation. reading_time
+        (datetime) of the sensor uplink is not used by this thermostat
+        '''
+        self._actuals_valid = humidity is not None and temperature is not None
+
+        temp_ok = True
+        hum_ok = True
+
+        if self._actuals_valid:
+            temp_ok, hum_ok = self._band_check(humidity, temperature,
+                                               self._output_state)
+
+        new_output_state = (not temp_ok) or (not hum_ok)
+        self._set_output(new_output_state, temp_ok, hum_ok)
+
+    def output_active(self):
+        '''
+        Returns True is the thermostat output shall be send to the relay
+        controller, ie when we have enough data to control the relay
+        '''
+        return self._actuals_valid
+
+    def output(self):
+        ''' Retrieve output, reflects desired output state (True/False) '''
+        return self._output_state
+
+    def status(self):
+        ''' Returns a dict of setpoints and output, for status reporting '''
+        return {"min_temp": self._min_temp, "max_rh": self._max_rh,
+                "active": self._actuals_valid, "output": self._output_state}
+
+
+class DwellThermostat(RHTThermostat):
+    '''
+    Thermostat minimizing relay toggles, and thereby LoRa downlinks. Uses
+    the same RH and temp hysteresis bands as RHTThermostat but holds the
+    output for a minimum on/off dwell time, caps the number of toggles per
+    hour and switches on ahead of a band crossing predicted from the trend
+    of recent readings. Switching off is never predicted, only delayed
+    '''
+
+    def __init__(self, min_temp=-5.0, max_rh=80.0):
+        '''
+        Constructor
+        '''
+        RHTThermostat.__init__(self, min_temp, max_rh)
+        self._min_on = timedelta(minutes=20)
+        self._min_off = timedelta(minutes=20)
+        self._max_toggles = 2
+        self._trend_window = timedelta(minutes=180)
+        self._lookahead = timedelta(minutes=60)
+        # List of (timestamp, humidity, temperature) readings in trend window
+        self._readings = []
+        self._toggle_ts = []
+
+    def set_min_dwell(self, min_on, min_off):
+        '''
+        Override default minimum on and off dwell times (timedelta)
+        '''
+        self._min_on = min_on
+        self._min_off = min_off
+
+    def set_max_toggles(self, max_toggles):
+        '''
+        Override default max number of output toggles per hour
+        '''
+        self._max_toggles = max_toggles
+
+    def set_prediction(self, trend_window, lookahead):
+        '''
+        Override default trend window and prediction lookahead (timedelta),
+        lookahead should match the sensor uplink interval. A zero lookahead
+        disables prediction
+        '''
+        self._trend_window = trend_window
+        self._lookahead = lookahead
+
+    def _add_reading(self, reading_time, now, humidity, temperature):
+        # The control loop repeats the last reading, only a newer sensor
+        # uplink is added
+        if reading_time is not None and \
+        (not self._readings or reading_time > self._readings[-1][0]):
+            self._readings.append((reading_time, humidity, temperature))
+        # Drop readings outside the trend window, always keeping the newest
+        while len(self._readings) > 1 and \
+        self._readings[0][0] < now - self._trend_window:
+            self._readings.pop(0)
+
+    def _predicted(self, now):
+        '''
+        Returns predicted (humidity, temperature) at now + lookahead from a
+        least squares fit of the readings in the trend window, or None
+        '''
+        if len(self._readings) < 3 or not self._lookahead:
+            return None
+
+        t_0 = self._readings[0][0]
+        times = [(reading[0] - t_0).total_seconds() for reading in self._readings]
+        t_mean = sum(times) / len(times)
+        t_var = sum((t - t_mean) ** 2 for t in times)
+        if not t_var:
+            return None
+
+        t_ahead = (now - t_0 + self._lookahead).total_seconds()
+        predicted = []
+        for index in (1, 2):
+            values = [reading[index] for reading in self._readings]
+            v_mean = sum(values) / len(values)
+            slope = sum((t - t_mean) * (v - v_mean)
+                        for t, v in zip(times, values)) / t_var
+            predicted.append(v_mean + slope * (t_ahead - t_mean))
+        return tuple(predicted)
+
+    def update_actual_values(self, humidity, temperature, reading_time=None,
+                             now=None):
+        '''
+        Update actual values and performs output calculation. reading_time
+        (datetime) is the time of the sensor uplink, readings without it are
+        not used for prediction. now (datetime) defaults to the current time
+        and is given when replaying recorded data
+        '''
+        if now is None:
+            now = datetime.now()
+
+        self._actuals_valid = humidity is not None and temperature is not None
+        if not self._actuals_valid:
+            # Same as RHTThermostat, no heating without valid data
+            self._set_output(False, True, True)
+            return
+
+        self._add_reading(reading_time, now, humidity, temperature)
+        temp_ok, hum_ok = self._band_check(humidity, temperature,
+                                           self._output_state)
+        demand = (not temp_ok) or (not hum_ok)
+
+        if not demand and not self._output_state and \
+        not all(self._band_check(humidity, temperature, True)):
+            # Inside the hysteresis band, where heating once on would be
+            # kept on. Switch on early if the next reading is predicted to
+            # cross the band
+            predicted = self._predicted(now)
+            if predicted:
+                pred_temp_ok, pred_hum_ok = self._band_check(predicted[0],
+                                                             predicted[1],
+                                                             False)
+                demand = (not pred_temp_ok) or (not pred_hum_ok)
+
+        if demand == self._output_state:
+            return
+
+        # Far outside the band, switch on regardless of dwell and toggle cap
+        severe = temperature < self._min_temp - self._temp_hyst or \
+                 humidity > self._max_rh + self._rh_hyst
+
+        self._toggle_ts = [ts for ts in self._toggle_ts
+                           if ts > now - timedelta(hours=1)]
+        if not (demand and severe):
+            dwell = self._min_on if self._output_state else self._min_off
+            if self._toggle_ts and self._toggle_ts[-1] + dwell > now:
+                return
+            if len(self._toggle_ts) >= self._max_toggles:
+                return
+
+        self._toggle_ts.append(now)
+        self._set_output(demand, temp_ok, hum_ok)
+
+
+# Thermostat classes by config mode, the first one is the default
+THERMOSTAT_MODES = collections.OrderedDict([("hysteresis", RHTThermostat),
+                                            ("dwell", DwellThermostat)])
+
+
+def configure_thermostat(thermo, thermo_cfg):
+    '''
+    Apply thermostat mode, setpoints and hysteresis from a config dict.
+    A mode change replaces the thermostat, keeping its output state.
+    Returns the configured thermostat
+    '''
+    thermo_class = THERMOSTAT_MODES[thermo_cfg["mode"]]
+    if type(thermo) is not thermo_class:
+        new_thermo = thermo_class()
+        new_thermo.restore_output(thermo.output())
+        thermo = new_thermo
+
+    thermo.set_limits(thermo_cfg["min_temp"], thermo_cfg["max_rh"])
+    thermo.set_temp_hysteresis(thermo_cfg["temp_hysteresis"])
+    thermo.set_rh_hysteresis(thermo_cfg["rh_hysteresis"])
+    if thermo_class is DwellThermostat:
+        thermo.set_min_dwell(
+            timedelta(minutes=thermo_cfg["dwell_min_on_minutes"]),
+            timedelta(minutes=thermo_cfg["dwell_min_off_minutes"]))
+        thermo.set_max_toggles(thermo_cfg["dwell_max_toggles_per_hour"])
+        thermo.set_prediction(
+            timedelta(minutes=thermo_cfg["dwell_trend_minutes"]),
+            timedelta(minutes=thermo_cfg["dwell_lookahead_minutes"]))
+    return thermo